@@ -1,19 +1,31 @@
+from . import patching  # noqa: F401  must stay the first import
 from flask import Flask, jsonify
 from flask_cors import CORS
 from flasgger import Swagger
 from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_mail import Mail
 from .config import config
+from .commands import register_commands
+from .views.rate_limit import limiter
+from .views.revocation import revocation
+from .views.write_behind import login_stamps
+from .views.health import readiness
+from .views.profiling import memory_stats
+from .views.tracing import tracer
+from .views.jwt_cache import CachingJWTManager
 from .database.mysql import db
 from .database.mongodb import init_mongodb, mongo  # noqa: F401
+from .database.routing import init_routing
+from .database.sharding import create_shard_tables
 
-from .routes import auth_route, root_route, user_route# noqa: F401
+from .routes import auth_route, root_route, user_route, report_route, health_route, debug_route  # noqa: F401 E501
+from .models import contribution  # noqa: F401
 
 
 bcrypt = Bcrypt()
 cors = CORS(supports_credentials=True)
+jwt = CachingJWTManager()
 
 
 def create_app(config_name: str) -> Flask:
@@ -24,10 +36,17 @@ def create_app(config_name: str) -> Flask:
     config[config_name].init_app(app)
     Swagger(app)
     bcrypt.init_app(app)
-    JWTManager(app)
+    jwt.init_app(app)
+    revocation.init_app(app, jwt)
     cors.init_app(app, resources={r"/*": {"origins": "*"}})
+    limiter.init_app(app)
+    login_stamps.init_app(app)
+    readiness.init_app(app)
+    memory_stats.init_app(app)
+    tracer.init_app(app)
 
     db.init_app(app)
+    init_routing(app)
     init_mongodb(app)
     Migrate(app, db)
     Mail(app)
@@ -36,6 +55,11 @@ def create_app(config_name: str) -> Flask:
     app.register_blueprint(root_route)
     app.register_blueprint(auth_route)
     app.register_blueprint(user_route)
+    app.register_blueprint(report_route)
+    app.register_blueprint(health_route)
+    app.register_blueprint(debug_route)
+
+    register_commands(app)
 
     # from .main import main as main_blueprint
     # app.register_blueprint(main_blueprint)
@@ -46,5 +70,6 @@ def create_app(config_name: str) -> Flask:
 
     with app.app_context():
         db.create_all()
+        create_shard_tables()
 
     return app
@@ -0,0 +1,279 @@
+import click
+from flask.cli import AppGroup
+
+reconcile_cli = AppGroup('reconcile', help='MySQL/MongoDB consistency checks.')
+users_cli = AppGroup('users', help='User maintenance tasks.')
+contributions_cli = AppGroup('contributions', help='Daily contribution runs.')
+export_cli = AppGroup('export', help='Bulk data exports.')
+keys_cli = AppGroup('keys', help='Primary key storage migrations.')
+shards_cli = AppGroup('shards', help='User shard maintenance.')
+
+
+@reconcile_cli.command('users')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users compared per range.')
+@click.option('--repair', is_flag=True,
+              help='Rewrite MongoDB to match MySQL instead of only reporting.')
+@click.option('--pause', default=0.0, show_default=True,
+              help='Seconds to sleep between batches to limit load.')
+@click.option('--restart', is_flag=True,
+              help='Ignore any saved checkpoint and start from the first id.')
+@click.option('--full', is_flag=True,
+              help='Diff every range, also catching MongoDB edits made '
+                   'outside the API that left the stored checksums stale.')
+def reconcile_users_command(batch_size, repair, pause, restart, full):
+    """Detect (and optionally repair) drift between users and user_collection."""
+    from .jobs.reconcile import reconcile_users
+
+    def on_issue(kind, user_id):
+        click.echo(f'{kind}\t{user_id}')
+
+    report = reconcile_users(batch_size=batch_size, repair=repair,
+                             pause=pause, restart=restart, full=full,
+                             on_issue=on_issue)
+    for key, value in report.to_dict().items():
+        click.echo(f'{key}: {value}')
+
+
+@users_cli.command('reindex-phones')
+@click.option('--batch-size', default=1000, show_default=True)
+def reindex_phones_command(batch_size):
+    """Backfill users.phone_normalized and users.name_normalized.
+
+    Run it for rows created before either column existed.
+    """
+    from .models import db
+    from .models.user import User, normalize_name, normalize_phone
+    from .database.sharding import each_shard, use_shard
+
+    updated = 0
+    for shard in each_shard():
+        after_id = None
+        while True:
+            with use_shard(shard):
+                query = User.query.with_entities(
+                    User.id, User.full_name, User.phone_number) \
+                    .order_by(User.id)
+                if after_id is not None:
+                    query = query.filter(User.id > after_id)
+                rows = query.limit(batch_size).all()
+                if not rows:
+                    break
+                db.session.execute(
+                    User.__table__.update()
+                    .where(User.__table__.c.id == db.bindparam('user_id'))
+                    .values(name_normalized=db.bindparam('name'),
+                            phone_normalized=db.bindparam('digits')),
+                    [{'user_id': user_id, 'name': normalize_name(full_name),
+                      'digits': normalize_phone(phone)}
+                     for user_id, full_name, phone in rows]
+                )
+                db.session.commit()
+            updated += len(rows)
+            after_id = rows[-1][0]
+    click.echo(f'reindexed {updated} users')
+
+
+@users_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Rows loaded per transaction.')
+@click.option('--workers', default=1, show_default=True,
+              help='Worker processes loading chunks in parallel.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help='Error report CSV (defaults to PATH.errors.csv).')
+@click.option('--restart', is_flag=True,
+              help='Ignore any saved checkpoint for this file.')
+def import_users_command(path, chunk_size, workers, errors_path, restart):
+    """Register every member listed in a CSV or XLSX file.
+
+    The header row names the columns: fullName, card_number, phone_number
+    and account_type. Rows that fail validation, repeat a card number or
+    are already registered are written to the error report. Re-running an
+    interrupted import of the same file resumes it.
+    """
+    from .jobs.importer import import_users, ImportUnavailable
+
+    def on_progress(report):
+        if report.rows and report.rows % (chunk_size * 10) < chunk_size:
+            click.echo(f'{report.rows} rows, {report.inserted} inserted, '
+                       f'{report.errors} rejected')
+
+    try:
+        report = import_users(path, chunk_size=chunk_size, workers=workers,
+                              errors_path=errors_path, restart=restart,
+                              on_progress=on_progress)
+    except ImportUnavailable as e:
+        raise click.ClickException(str(e))
+    for key, value in report.to_dict().items():
+        click.echo(f'{key}: {value}')
+
+
+@users_cli.command('archive-legacy')
+@click.option('--batch-size', default=500, show_default=True)
+def archive_legacy_command(batch_size):
+    """Move old per-user deleted_user documents into the monthly archive."""
+    from .views.archive import archive_legacy
+
+    click.echo(f'archived {archive_legacy(batch_size)} deleted users')
+
+
+@contributions_cli.command('post')
+@click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Day to post (defaults to today).')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Wallets posted per transaction.')
+@click.option('--workers', default=1, show_default=True,
+              help='Worker processes posting chunks in parallel.')
+@click.option('--restart', is_flag=True,
+              help='Ignore any saved checkpoint for this date.')
+def post_contributions_command(run_date, chunk_size, workers, restart):
+    """Post the daily contribution for every due wallet.
+
+    Safe to schedule (e.g. from cron) and to re-run: wallets already posted
+    for the date are skipped.
+    """
+    from .jobs.posting import run_daily_posting
+
+    def on_progress(report):
+        if report.chunks % 10 == 0:
+            click.echo(f'{report.wallets} wallets, {report.posted} posted')
+
+    report = run_daily_posting(
+        run_date=run_date.date() if run_date else None,
+        chunk_size=chunk_size, workers=workers, restart=restart,
+        on_progress=on_progress
+    )
+    for key, value in report.to_dict().items():
+        click.echo(f'{key}: {value}')
+
+
+@contributions_cli.command('backfill-rollups')
+@click.option('--from', 'start', required=True,
+              type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--to', 'end', required=True,
+              type=click.DateTime(formats=['%Y-%m-%d']))
+def backfill_rollups_command(start, end):
+    """Rebuild contribution_daily_totals from the posting ledger."""
+    from .jobs.rollups import backfill_daily_totals
+
+    def on_day(day, groups):
+        click.echo(f'{day.isoformat()}: {groups} rollup rows')
+
+    backfill_daily_totals(start.date(), end.date(), on_day=on_day)
+
+
+@export_cli.command('statements')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'export_format', default='csv', show_default=True,
+              type=click.Choice(['csv', 'parquet']))
+@click.option('--account-type', help='Only users with this account type.')
+@click.option('--from', 'start', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Only wallets updated on or after this day.')
+@click.option('--to', 'end', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Only wallets updated on or before this day.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Rows fetched (and Parquet row group size) per batch.')
+def export_statements_command(output, export_format, account_type, start, end,
+                              batch_size):
+    """Write a statement export of every wallet and its owner to OUTPUT."""
+    from .jobs.export import export_statements
+
+    written = 0
+    with open(output, 'wb') as export_file:
+        for chunk in export_statements(
+                export_format, account_type=account_type,
+                start=start.date() if start else None,
+                end=end.date() if end else None,
+                batch_size=batch_size):
+            export_file.write(chunk)
+            written += len(chunk)
+    click.echo(f'wrote {written} bytes to {output}')
+
+
+def uuid_key_columns():
+    """
+    (table, column) for every UUIDKey column, referenced tables first
+    """
+    from .models import db
+    from .models.types import UUIDKey
+
+    return [(table, column)
+            for table in db.metadata.sorted_tables
+            for column in table.columns
+            if isinstance(column.type, UUIDKey)]
+
+
+@keys_cli.command('to-binary')
+@click.option('--execute', is_flag=True,
+              help='Run the statements instead of printing them.')
+def keys_to_binary_command(execute):
+    """Convert CHAR(36) UUID key columns to BINARY(16) on MySQL.
+
+    Existing ids keep their value; only their storage changes. Run it with
+    the application stopped, then start it with BINARY_UUID_KEYS=1.
+    """
+    from .models import db
+
+    statements = ['SET FOREIGN_KEY_CHECKS=0']
+    for table, column in uuid_key_columns():
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        statements += [
+            f'ALTER TABLE `{table.name}` MODIFY `{column.name}` VARBINARY(36) {null}',
+            f"UPDATE `{table.name}` SET `{column.name}` = UNHEX(REPLACE(`{column.name}`, '-', '')) "
+            f'WHERE LENGTH(`{column.name}`) = 36',
+            f'ALTER TABLE `{table.name}` MODIFY `{column.name}` BINARY(16) {null}',
+        ]
+    statements.append('SET FOREIGN_KEY_CHECKS=1')
+
+    if not execute:
+        for statement in statements:
+            click.echo(f'{statement};')
+        return
+
+    if db.engine.dialect.name != 'mysql':
+        raise click.ClickException('to-binary only supports MySQL')
+    with db.engine.begin() as connection:
+        for statement in statements:
+            click.echo(statement)
+            connection.exec_driver_sql(statement)
+
+
+@shards_cli.command('rebalance')
+@click.option('--include-default', is_flag=True,
+              help='Also move users out of the unsharded default database.')
+@click.option('--execute', is_flag=True,
+              help='Move the users instead of only counting them.')
+@click.option('--batch-size', default=500, show_default=True,
+              help='Users read per batch.')
+def rebalance_shards_command(include_default, execute, batch_size):
+    """Move users onto the shard their card number maps to.
+
+    Run it with --include-default once when sharding is first turned on,
+    and again after adding a shard to DATABASE_SHARD_URLS. Moves can be
+    retried if the run is interrupted.
+    """
+    from .database.sharding import rebalance
+
+    def on_batch(source, moves):
+        moved = sum(count for (origin, _), count in moves.items()
+                    if origin == source)
+        click.echo(f'{source or "default"}: {moved}')
+
+    try:
+        moves = rebalance(include_default=include_default, execute=execute,
+                          batch_size=batch_size, on_batch=on_batch)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for (source, target), count in sorted(moves.items(), key=str):
+        verb = 'moved' if execute else 'to move'
+        click.echo(f'{source or "default"} -> {target}\t{count} {verb}')
+
+
+def register_commands(app):
+    app.cli.add_command(reconcile_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(contributions_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(keys_cli)
+    app.cli.add_command(shards_cli)
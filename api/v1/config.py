@@ -1,6 +1,8 @@
 from os import environ
 from dotenv import load_dotenv
 from datetime import timedelta
+from tempfile import gettempdir
+import os
 
 load_dotenv('.env')
 
@@ -14,6 +16,24 @@ DB_USERNAME = environ.get('DB_USERNAME', 'swaz_user')
 DB_PASSWORD = environ.get('DB_PASSWORD', 'swaz_psswd')
 DB_NAME = environ.get('DB_NAME', 'swaz_db')
 
+# Store UUID keys as BINARY(16) instead of CHAR(36); only enable after
+# running `flask keys to-binary` against the database
+BINARY_UUID_KEYS = environ.get('BINARY_UUID_KEYS', '0') == '1'
+
+# SQL connection pool per engine, and the connections the database server
+# allows this service in total; serve.py sizes workers from both, counting
+# one pool per engine (the primary plus every replica and shard bind)
+DB_POOL_SIZE = int(environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(environ.get('DB_MAX_OVERFLOW', '10'))
+DB_MAX_CONNECTIONS = int(environ.get('DB_MAX_CONNECTIONS', '151'))
+
+# Comma separated shard URLs; users and wallets are spread over them by a
+# hash of the card number (see database/sharding.py)
+DB_SHARD_URLS = [url.strip() for url in environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()]  # noqa: E501
+
+# Comma separated read replica URLs; reads in GET requests are routed to them
+DB_REPLICA_URLS = [url.strip() for url in environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]  # noqa: E501
+
 
 class Config:
     SECRET_KEY = environ.get('SECRET_KEY', 'hard to guess string')
@@ -37,10 +57,86 @@ class Config:
         f'{DB_TYPE}://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'  # noqa: E501
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+    }
+    SQLALCHEMY_BINDS = {
+        **{f'replica_{index}': url for index, url in enumerate(DB_REPLICA_URLS)},
+        **{f'shard_{index}': url for index, url in enumerate(DB_SHARD_URLS)},
+    }
+    # Seconds a client stays on the primary after a successful write
+    REPLICA_STICKY_SECONDS = int(environ.get('REPLICA_STICKY_SECONDS', '5'))
 
     mongo_uri = f'mongodb://{DB_USERNAME}:{DB_PASSWORD}@{MONGODB_HOST}:{MONGODB_PORT}/{DB_NAME}'  # noqa: E501
     # mongo_uri = f'mongodb://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{MONGODB_PORT}/{DB_NAME}?authSource={DB_NAME}'  # noqa: E501
     MONGO_URI = environ.get('MONGO_URI', mongo_uri)
+    # primary, primary_preferred, secondary, secondary_preferred or nearest
+    MONGO_READ_PREFERENCE = environ.get('MONGO_READ_PREFERENCE', 'primary')
+
+    # Idempotency-Key support for retried writes
+    IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+    IDEMPOTENCY_LOCK_SECONDS = 30
+    IDEMPOTENCY_WAIT_SECONDS = 10
+
+    # Token buckets for expensive auth endpoints, shared by all local workers
+    RATELIMIT_ENABLED = environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_STORAGE_URI = environ.get(
+        'RATELIMIT_STORAGE_URI',
+        f"sqlite:///{os.path.join(gettempdir(), 'swaz_ratelimit.db')}"
+    )
+    RATELIMIT_LIMITS = {
+        'login': {'ip': '20/minute', 'identity': '5/minute'},
+        'verify_user': {'ip': '20/minute', 'identity': '5/minute'},
+    }
+
+    # Verified tokens remembered per worker to skip repeat verification
+    JWT_DECODE_CACHE_SIZE = 10000
+
+    # Revoked JWTs: per-worker Bloom filter over the shared denylist
+    REVOCATION_REFRESH_SECONDS = 5
+    REVOCATION_REBUILD_SECONDS = 3600
+    REVOCATION_BLOOM_CAPACITY = 100000
+    REVOCATION_BLOOM_ERROR_RATE = 0.001
+
+    # last_login / last_logout stamps are batched and written behind
+    WRITE_BEHIND_FLUSH_MS = 500
+    WRITE_BEHIND_MAX_ENTRIES = 500
+    # Documents kept for retry while MongoDB is failing; oldest dropped first
+    WRITE_BEHIND_MAX_PENDING = 50000
+
+    # /api/v1/health/ready: probe timeout and how long a result is reused
+    HEALTH_PROBE_TIMEOUT_SECONDS = float(
+        environ.get('HEALTH_PROBE_TIMEOUT_SECONDS', '1'))
+    HEALTH_CACHE_SECONDS = float(environ.get('HEALTH_CACHE_SECONDS', '2'))
+
+    # Seconds between each worker's RSS/GC stats lines; 0 turns them off
+    MEMORY_STATS_INTERVAL_SECONDS = float(
+        environ.get('MEMORY_STATS_INTERVAL_SECONDS', '60'))
+
+    # Span tracing: share of requests recorded (0 turns tracing off) and
+    # the OTLP/JSON lines file spans are appended to. Requests a caller
+    # sampled in its traceparent are always recorded when the caller is in
+    # TRACE_TRUSTED_PEERS (comma separated addresses or networks such as
+    # 10.0.0.0/8); from anyone else the flag is ignored.
+    TRACE_SAMPLE_RATE = float(environ.get('TRACE_SAMPLE_RATE', '0'))
+    TRACE_TRUSTED_PEERS = [peer.strip() for peer in environ.get(
+        'TRACE_TRUSTED_PEERS', '').split(',') if peer.strip()]
+    TRACE_EXPORT_PATH = environ.get(
+        'TRACE_EXPORT_PATH', os.path.join(gettempdir(), 'swaz_traces.jsonl'))
+    TRACE_SERVICE_NAME = environ.get('TRACE_SERVICE_NAME',
+                                     'daily-contribution-api')
+    TRACE_FLUSH_SECONDS = 1
+
+    # Shared secret for admin-only endpoints (X-Admin-Key header)
+    ADMIN_API_KEY = environ.get('ADMIN_API_KEY')
+
+    # Longest date range a contribution report may cover
+    REPORT_MAX_DAYS = 366
+
+    # Deleted users are kept in monthly buckets of compressed records
+    ARCHIVE_RETENTION_DAYS = int(environ.get('ARCHIVE_RETENTION_DAYS', '2555'))
+    ARCHIVE_BUCKET_SIZE = 500
 
     @staticmethod
     def init_app(app):
@@ -72,6 +168,7 @@ class DevelopmentConfig(Config):
 
 class TestingConfig(Config):
     TESTING = True
+    RATELIMIT_STORAGE_URI = 'memory://'
 
 
 class ProductionConfig(Config):
@@ -1,5 +1,7 @@
 from .mysql import db as mysql_db, init_mysql, get_mysql_session, init_mysql_db
-from .mongodb import mongo, init_mongodb, get_mongo_client
+from .mongodb import mongo, init_mongodb, get_mongo_client, for_reads  # noqa: F401
+from .routing import init_routing  # noqa: F401
+from .sharding import shard_for, use_shard, scatter_gather  # noqa: F401
 
 
 class DatabaseManager:
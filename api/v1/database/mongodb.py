@@ -1,17 +1,41 @@
+from flask import current_app
 from flask_pymongo import PyMongo
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference
 from os import environ
 
 from ..config import config
+from .routing import reads_from_replica
+from ..views.tracing import mongo_command_tracer
 
 mongo = PyMongo()
 
 
+def _event_listeners(sample_rate):
+    # With tracing off the client gets no command listener at all
+    return [mongo_command_tracer] if sample_rate > 0 else []
+
+
 def init_mongodb(app):
-    mongo.init_app(app)
+    mongo.init_app(app, event_listeners=_event_listeners(
+        app.config['TRACE_SAMPLE_RATE']))
 
 
 def get_mongo_client():
+    settings = config[environ.get('FLASK_ENV', 'development')]
     return MongoClient(
-        config[environ.get('FLASK_ENV', 'development')].MONGO_URI
+        settings.MONGO_URI,
+        event_listeners=_event_listeners(settings.TRACE_SAMPLE_RATE)
+    )
+
+
+def for_reads(collection):
+    """
+    Collection handle using MONGO_READ_PREFERENCE while serving a read-only
+    request; writes and read-your-writes requests stay on the primary
+    """
+    if not reads_from_replica():
+        return collection
+    name = current_app.config.get('MONGO_READ_PREFERENCE', 'primary')
+    return collection.with_options(
+        read_preference=getattr(ReadPreference, name.upper())
     )
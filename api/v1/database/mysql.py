@@ -5,8 +5,9 @@ from sqlalchemy.ext.declarative import declarative_base
 from os import environ
 
 from ..config import config
+from .routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 def init_mysql(app):
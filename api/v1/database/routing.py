@@ -0,0 +1,141 @@
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from datetime import datetime, timedelta
+import random
+import time
+
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+STICKY_COOKIE = 'db_primary_until'
+
+_indexes_ready = False
+
+
+def replica_keys(engines):
+    return sorted(key for key in engines
+                  if isinstance(key, str) and key.startswith('replica_'))
+
+
+def reads_from_replica():
+    """
+    True while serving a read-only request that has no recent write to see.
+    Whether the token's identity wrote recently is looked up the first
+    time a read could go to a replica, so requests that never read pay
+    no MongoDB round trip.
+    """
+    if not has_request_context() or not g.get('db_read_only', False):
+        return False
+    if 'db_identity_sticky' not in g:
+        identity = _identity()
+        g.db_identity_sticky = identity is not None \
+            and _identity_is_sticky(identity)
+    return not g.db_identity_sticky
+
+
+class RoutingSession(Session):
+    """
+    Session that sends statements to a read replica while serving a
+    read-only request, and to the primary for everything else.
+    Once the session flushes it stays on the primary, so a request always
+    reads its own writes. Inside use_shard() everything goes to that shard.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = self.info.get('shard')
+        if bind is None and shard is not None:
+            return self._db.engines[shard]
+        if bind is None and not self._flushing \
+                and not self.info.get('wrote') and reads_from_replica():
+            engines = self._db.engines
+            key = self.info.get('replica')
+            if key is None:
+                keys = replica_keys(engines)
+                if keys:
+                    # One replica per session keeps a request's reads consistent
+                    key = self.info['replica'] = random.choice(keys)
+            if key is not None:
+                return engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_wrote(session, flush_context):
+    session.info['wrote'] = True
+
+
+def _identity():
+    """
+    The JWT identity of the request, if it carries a valid token
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        return None
+    return None if identity is None else str(identity)
+
+
+def _sticky_collection():
+    from ..models import primary_sticky_collection
+
+    global _indexes_ready
+    if not _indexes_ready:
+        primary_sticky_collection.create_index('expires_at',
+                                               expireAfterSeconds=0)
+        _indexes_ready = True
+    return primary_sticky_collection
+
+
+def _identity_is_sticky(identity):
+    try:
+        return _sticky_collection().find_one(
+            {'_id': identity, 'expires_at': {'$gt': datetime.utcnow()}},
+            {'_id': 1}) is not None
+    except Exception as e:
+        # Reading the primary is always correct, just slower
+        print(f"Sticky identity lookup failed: {str(e)}")
+        return True
+
+
+def _stick_identity(identity, sticky_seconds):
+    try:
+        _sticky_collection().update_one(
+            {'_id': identity},
+            {'$set': {'expires_at': datetime.utcnow()
+                      + timedelta(seconds=sticky_seconds)}},
+            upsert=True)
+    except Exception as e:
+        print(f"Could not mark identity sticky: {str(e)}")
+
+
+def init_routing(app):
+    """
+    Flag read-only requests and make clients that just wrote stick to
+    the primary for REPLICA_STICKY_SECONDS, so they read their own writes.
+    Browsers are tracked with a cookie; token clients, which may drop
+    cookies, by their JWT identity in MongoDB.
+    With no replicas configured no hooks are installed.
+    """
+    if not replica_keys(app.config.get('SQLALCHEMY_BINDS') or {}):
+        return
+    sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+
+    @app.before_request
+    def _route_reads():
+        # The cookie is free to check; the identity waits for the first read
+        primary_until = request.cookies.get(STICKY_COOKIE, type=float) or 0
+        g.db_read_only = request.method in READ_METHODS \
+            and primary_until < time.time()
+
+    @app.after_request
+    def _stick_after_write(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE,
+                                str(time.time() + sticky_seconds),
+                                max_age=sticky_seconds, httponly=True,
+                                samesite='Lax')
+            identity = _identity()
+            if identity is not None:
+                _stick_identity(identity, sticky_seconds)
+        return response
@@ -0,0 +1,243 @@
+from contextlib import contextmanager
+from sqlalchemy import delete, or_, select
+import hashlib
+import heapq
+
+from .mysql import db
+
+# Tables split across the shards; every row of a user lives on one shard.
+# Each shard keeps the posting ledger of its wallets and rolls it up itself.
+SHARDED_TABLES = ('users', 'wallets', 'user_wallet', 'contribution_postings',
+                  'contribution_daily_totals')
+
+
+def shard_keys(engines=None):
+    """
+    Bind keys of the configured shards, in shard order
+    """
+    engines = db.engines if engines is None else engines
+    keys = [key for key in engines
+            if isinstance(key, str) and key.startswith('shard_')]
+    return sorted(keys, key=lambda key: int(key[len('shard_'):]))
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach): going from n to n + 1 buckets
+    moves only 1/(n + 1) of the keys
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(card_number, shards=None):
+    """
+    Bind key of the shard holding card_number's user, or None when the
+    users are not sharded
+    """
+    shards = shard_keys() if shards is None else shards
+    if not shards:
+        return None
+    digest = hashlib.blake2b(card_number.encode('utf-8'), digest_size=8).digest()
+    return shards[jump_hash(int.from_bytes(digest, 'big'), len(shards))]
+
+
+@contextmanager
+def use_shard(key):
+    """
+    Send the session's statements to the shard bound as key while inside
+    the block. A key of None leaves the usual routing in place.
+    """
+    session = db.session()
+    previous = session.info.get('shard')
+    session.info['shard'] = key
+    try:
+        yield
+    finally:
+        session.info['shard'] = previous
+
+
+def each_shard():
+    """
+    The shard keys to visit for a query over every user; [None] when the
+    users are not sharded
+    """
+    return shard_keys() or [None]
+
+
+def shard_urls():
+    """
+    {shard key: database URL} for every shard, for processes that open
+    their own connections; {None: default URL} when not sharded
+    """
+    return {shard: db.engines[shard].url.render_as_string(hide_password=False)
+            for shard in each_shard()}
+
+
+def scatter_gather(make_query, key=None, batch_size=1000):
+    """
+    Run make_query() on every shard and stream the rows back. With key,
+    each shard's query must be ordered by it and the streams are merged
+    lazily into one ordered stream.
+    Rows are compared in Python, so text sort columns must be BinaryString
+    columns, which the database orders by code point as Python does.
+    """
+    session = db.session()
+    streams = []
+    for shard in each_shard():
+        with use_shard(shard):
+            # Executed here, inside the block: iterating a Query defers it
+            query = make_query()
+            result = session.execute(query.statement,
+                                     execution_options={'yield_per': batch_size})
+            streams.append(iter(result.scalars() if query.is_single_entity
+                                else result))
+    if key is None:
+        return (row for stream in streams for row in stream)
+    return heapq.merge(*streams, key=key)
+
+
+def locate(value, *columns):
+    """
+    The shard holding a user with value in any of columns, found by asking
+    every shard; use shard_for when the card number is known
+    """
+    from ..models.user import User
+
+    shards = shard_keys()
+    for shard in shards:
+        with use_shard(shard):
+            if User.query.with_entities(User.id).filter(
+                    or_(*[column == value for column in columns])).first():
+                return shard
+    return None
+
+
+def shard_of_user(key):
+    """
+    The shard holding the user whose card number or id is key: the shard
+    the key maps to as a card number is checked first, then every shard
+    by id or card number, which finds users whose move is unfinished.
+    None when the users are not sharded or nobody matches.
+    """
+    from ..models.user import User
+
+    shards = shard_keys()
+    if not shards:
+        return None
+    by_card = shard_for(key, shards)
+    with use_shard(by_card):
+        if User.query.with_entities(User.id) \
+                .filter(User.card_number == key).first():
+            return by_card
+    return locate(key, User.id, User.card_number)
+
+
+def create_shard_tables():
+    """
+    Create the sharded tables on every shard that lacks them
+    """
+    tables = [db.metadata.tables[name] for name in SHARDED_TABLES]
+    for shard in shard_keys():
+        db.metadata.create_all(db.engines[shard], tables=tables)
+
+
+def move_users(source, target, user_ids):
+    """
+    Copy users, their wallets, wallet links and postings from one database
+    to another, then delete them from the source. The copy replaces any rows
+    a previous, interrupted move left on the target, so it can be retried.
+    """
+    tables = db.metadata.tables
+    users, wallets, links, postings = (
+        tables['users'], tables['wallets'], tables['user_wallet'],
+        tables['contribution_postings'])
+    engines = db.engines
+    with engines[source].connect() as connection:
+        user_rows = connection.execute(
+            select(users).where(users.c.id.in_(user_ids))).mappings().all()
+        link_rows = connection.execute(
+            select(links).where(links.c.user_id.in_(user_ids))
+        ).mappings().all()
+        # Owned wallets, and linked ones the links need on the target
+        wallet_rows = connection.execute(
+            select(wallets).where(
+                wallets.c.user_id.in_(user_ids)
+                | wallets.c.id.in_([row['wallet_id'] for row in link_rows]))
+        ).mappings().all()
+        posting_rows = connection.execute(
+            select(postings).where(postings.c.wallet_id.in_(
+                [row['id'] for row in wallet_rows]))
+        ).mappings().all()
+    if not user_rows:
+        return 0
+    wallet_ids = [row['id'] for row in wallet_rows]
+
+    with engines[target].begin() as connection:
+        connection.execute(delete(postings).where(
+            postings.c.wallet_id.in_(wallet_ids)))
+        connection.execute(delete(links).where(links.c.user_id.in_(user_ids)))
+        connection.execute(delete(wallets).where(wallets.c.id.in_(wallet_ids)))
+        connection.execute(delete(users).where(users.c.id.in_(user_ids)))
+        connection.execute(users.insert(), [dict(row) for row in user_rows])
+        if wallet_rows:
+            connection.execute(wallets.insert(), [dict(row) for row in wallet_rows])
+        if link_rows:
+            connection.execute(links.insert(), [dict(row) for row in link_rows])
+        if posting_rows:
+            connection.execute(postings.insert(),
+                               [dict(row) for row in posting_rows])
+
+    with engines[source].begin() as connection:
+        connection.execute(delete(postings).where(
+            postings.c.wallet_id.in_(wallet_ids)))
+        connection.execute(delete(links).where(links.c.user_id.in_(user_ids)))
+        connection.execute(delete(wallets).where(wallets.c.id.in_(wallet_ids)))
+        connection.execute(delete(users).where(users.c.id.in_(user_ids)))
+    return len(user_rows)
+
+
+def rebalance(include_default=False, execute=False, batch_size=500,
+              on_batch=None):
+    """
+    Move every user that is not on the shard its card number maps to.
+    Sources are the shards, plus the unsharded default database when
+    include_default is set (the initial migration). Without execute only
+    counts what would move. Returns {(source, target): users}.
+    """
+    shards = shard_keys()
+    if not shards:
+        raise RuntimeError('No shards configured (DATABASE_SHARD_URLS)')
+    users = db.metadata.tables['users']
+    sources = ([None] if include_default else []) + shards
+    moves = {}
+    for source in sources:
+        after_id = None
+        while True:
+            stmt = select(users.c.id, users.c.card_number).order_by(users.c.id) \
+                .limit(batch_size)
+            if after_id is not None:
+                stmt = stmt.where(users.c.id > after_id)
+            with db.engines[source].connect() as connection:
+                rows = connection.execute(stmt).all()
+            if not rows:
+                break
+            after_id = rows[-1][0]
+
+            by_target = {}
+            for user_id, card_number in rows:
+                target = shard_for(card_number, shards)
+                if target != source:
+                    by_target.setdefault(target, []).append(user_id)
+            for target, user_ids in by_target.items():
+                if execute:
+                    move_users(source, target, user_ids)
+                moves[(source, target)] = moves.get((source, target), 0) \
+                    + len(user_ids)
+            if on_batch:
+                on_batch(source, moves)
+    return moves
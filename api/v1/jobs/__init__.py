@@ -0,0 +1 @@
+from .checkpoint import Checkpoint  # noqa: F401
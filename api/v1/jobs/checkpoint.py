@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from ..models import job_checkpoint_collection
+
+
+class Checkpoint:
+    """
+    Persisted progress marker that lets a long running job resume
+    where a previous run stopped
+    """
+    def __init__(self, name, collection=job_checkpoint_collection):
+        self.name = name
+        self.collection = collection
+
+    def load(self):
+        doc = self.collection.find_one({'_id': self.name})
+        return doc.get('state') if doc else None
+
+    def save(self, state):
+        self.collection.update_one(
+            {'_id': self.name},
+            {'$set': {'state': state, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def clear(self):
+        self.collection.delete_one({'_id': self.name})
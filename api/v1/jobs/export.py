@@ -0,0 +1,156 @@
+from datetime import datetime, time as day_time
+from sqlalchemy import select
+import csv
+import io
+
+from ..models import db
+from ..database.sharding import each_shard, use_shard
+from ..models.user import User, Wallet
+
+EXPORT_COLUMNS = [
+    ('user_id', User.id),
+    ('full_name', User.full_name),
+    ('card_number', User.card_number),
+    ('phone_number', User.phone_number),
+    ('account_type', User.account_type),
+    ('wallet_id', Wallet.id),
+    ('wallet_balance', Wallet.balance),
+    ('wallet_updated_at', Wallet.updated_at),
+]
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+class ExportUnavailable(Exception):
+    """
+    Raised when a requested export format's optional dependency is missing
+    """
+
+
+def statement_query(account_type=None, start=None, end=None):
+    """
+    Wallet balances joined to their owner, optionally limited to one
+    account type and to wallets updated between start and end (dates)
+    """
+    stmt = select(*[column for _, column in EXPORT_COLUMNS]) \
+        .join(User, User.id == Wallet.user_id)
+    if account_type:
+        stmt = stmt.where(User.account_type == account_type)
+    if start:
+        stmt = stmt.where(Wallet.updated_at >= datetime.combine(start, day_time.min))
+    if end:
+        stmt = stmt.where(Wallet.updated_at <= datetime.combine(end, day_time.max))
+    return stmt.order_by(Wallet.id)
+
+
+def iter_row_batches(stmt, batch_size=5000):
+    """
+    Stream result rows in batches through a server-side cursor, so memory
+    stays bounded by batch_size whatever the size of the export. With
+    shards, each shard's rows follow the previous shard's.
+    """
+    for shard in each_shard():
+        with use_shard(shard):
+            # Executed inside the block; the cursor keeps its connection
+            result = db.session.execute(
+                stmt.execution_options(yield_per=batch_size))
+        for batch in result.partitions():
+            yield batch
+
+
+def iter_csv(batches):
+    """
+    Encode row batches as CSV, one chunk of bytes per batch
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object that hands bytes back instead of storing them
+    """
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_parquet(batches):
+    """
+    Encode row batches as Parquet, writing one row group per batch and
+    yielding the bytes as soon as each row group is flushed
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportUnavailable('Parquet export requires pyarrow')
+
+    schema = pa.schema([
+        ('user_id', pa.string()),
+        ('full_name', pa.string()),
+        ('card_number', pa.string()),
+        ('phone_number', pa.string()),
+        ('account_type', pa.string()),
+        ('wallet_id', pa.string()),
+        ('wallet_balance', pa.float64()),
+        ('wallet_updated_at', pa.timestamp('s')),
+    ])
+
+    def generate():
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            for batch in batches:
+                columns = list(zip(*batch))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type)
+                     for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return generate()
+
+
+def export_statements(export_format, account_type=None, start=None, end=None,
+                      batch_size=5000):
+    """
+    Byte chunks of a statement export in the given format.
+    Must be consumed inside an application context.
+    """
+    batches = iter_row_batches(statement_query(account_type, start, end),
+                               batch_size=batch_size)
+    if export_format == 'parquet':
+        return iter_parquet(batches)
+    return iter_csv(batches)
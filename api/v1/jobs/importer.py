@@ -0,0 +1,360 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+from pymongo.errors import BulkWriteError
+from sqlalchemy import create_engine, select
+from werkzeug.exceptions import BadRequest
+import csv
+import hashlib
+import os
+import time
+
+from ..models import db, user_collection
+from ..models.user import User, Wallet, user_wallet
+from ..models.types import new_id
+from ..database.mongodb import get_mongo_client
+from ..database.sharding import shard_for, shard_keys, shard_urls
+from .checkpoint import Checkpoint
+from .reconcile import CHECKSUM_FIELD, mirror_checksum
+
+users = User.__table__
+wallets = Wallet.__table__
+
+# Header spellings accepted for each field, as sent by the API or by hand
+COLUMN_ALIASES = {
+    'fullName': ('fullname', 'full_name', 'full name', 'name'),
+    'card_number': ('card_number', 'card number', 'cardnumber', 'card'),
+    'phone_number': ('phone_number', 'phonenumber', 'phone number', 'phone'),
+    'account_type': ('account_type', 'account type', 'accounttype'),
+}
+ERROR_COLUMNS = ['line', 'card_number', 'error']
+DUPLICATE_KEY = 11000
+
+# Connections owned by each pool worker process, created by _init_worker
+_worker_engines = None
+_worker_collection = None
+
+
+class ImportUnavailable(Exception):
+    """
+    Raised when reading a file format needs a missing optional dependency
+    """
+
+
+class ImportReport:
+    """
+    Totals for one import run
+    """
+    def __init__(self, path):
+        self.file = path
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data['rows_per_second'] = round(self.rows_per_second, 1)
+        return data
+
+
+def _canonical_header(header):
+    names = {}
+    for index, name in enumerate(header):
+        name = str(name or '').strip().lower()
+        for field, aliases in COLUMN_ALIASES.items():
+            if name in aliases:
+                names[index] = field
+    return names
+
+
+def _records(header, rows):
+    names = _canonical_header(header)
+    for line, row in rows:
+        record = {}
+        for index, value in enumerate(row):
+            if index in names and value is not None:
+                value = str(value).strip()
+                record[names[index]] = value or None
+        # Blank lines are not rows
+        if any(record.values()):
+            yield line, record
+
+
+def iter_csv_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        reader = csv.reader(source)
+        header = next(reader, [])
+        yield from _records(header, ((reader.line_num, row) for row in reader))
+
+
+def iter_xlsx_rows(path):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportUnavailable('XLSX import requires openpyxl')
+
+    # Read-only mode streams the sheet instead of loading it whole
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, ())
+        yield from _records(header, enumerate(rows, start=2))
+    finally:
+        workbook.close()
+
+
+def iter_rows(path):
+    """
+    (line, record) for each data row of a CSV or XLSX file
+    """
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        return iter_xlsx_rows(path)
+    return iter_csv_rows(path)
+
+
+def validate_row(record):
+    """
+    The users row for a file record, checked the way register_user
+    checks a request body. Raises BadRequest.
+    """
+    user = User()
+    user.validate_data(record)
+    user.phone_number = record.get('phone_number')
+    return {
+        'id': user.id,
+        'full_name': user.full_name,
+        'name_normalized': user.name_normalized,
+        'card_number': user.card_number,
+        'phone_number': user.phone_number,
+        'phone_normalized': user.phone_normalized,
+        'account_type': user.account_type,
+        'balance': 0.0,
+    }
+
+
+def load_chunk(connection, collection, rows, import_id):
+    """
+    Insert the rows of one chunk into both stores: executemany INSERTs of
+    the users and the wallet register_user gives each of them, and one
+    insert_many. Card numbers already registered are reported;
+    ones this import wrote on an earlier, interrupted run are skipped.
+    Returns (inserted, skipped, errors) where errors are (line, card, error).
+    """
+    if not rows:
+        return 0, 0, []
+    cards = [row['card_number'] for _, row in rows]
+    in_sql = set(connection.execute(
+        select(users.c.card_number).where(users.c.card_number.in_(cards))
+    ).scalars())
+    in_mongo = {
+        doc['card_number']: doc.get('import_id')
+        for doc in collection.find({'card_number': {'$in': cards}},
+                                   {'card_number': 1, 'import_id': 1})
+    }
+
+    inserts, skipped, errors = [], 0, []
+    for line, row in rows:
+        card = row['card_number']
+        ours = in_mongo.get(card) == import_id
+        if card in in_sql:
+            if ours:
+                skipped += 1
+            else:
+                errors.append((line, card, 'card_number is already registered'))
+        elif card in in_mongo and not ours:
+            errors.append((line, card, 'card_number is already registered'))
+        else:
+            inserts.append(row)
+    if not inserts:
+        return 0, skipped, errors
+
+    connection.execute(users.insert(), inserts)
+    new_wallets = [
+        {'id': new_id(), 'user_id': row['id'], 'card_number': row['card_number'],
+         'balance': 0.0, 'daily_amount': 0.0}
+        for row in inserts
+    ]
+    connection.execute(wallets.insert(), new_wallets)
+    connection.execute(user_wallet.insert(), [
+        {'user_id': wallet['user_id'], 'wallet_id': wallet['id']}
+        for wallet in new_wallets
+    ])
+    documents = [
+        {
+            'id': row['id'],
+            'fullName': row['full_name'],
+            'card_number': row['card_number'],
+            'phone_number': row['phone_number'],
+            'account_type': row['account_type'],
+            'import_id': import_id,
+        }
+        for row in inserts if row['card_number'] not in in_mongo
+    ]
+    for document in documents:
+        document[CHECKSUM_FIELD] = mirror_checksum(document)
+    if documents:
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # A concurrent registration won the card number in MongoDB
+            if any(error['code'] != DUPLICATE_KEY
+                   for error in e.details['writeErrors']):
+                raise
+    return len(inserts), skipped, errors
+
+
+def load_sharded(engines, collection, rows, import_id):
+    """
+    load_chunk the rows on the shard each card number maps to, one
+    transaction per shard; engines is {shard key: engine}, {None: engine}
+    when not sharded. A chunk that failed part way can be loaded again:
+    rows an earlier attempt committed are skipped.
+    """
+    shards = [shard for shard in engines if shard is not None]
+    by_shard = {}
+    for line, row in rows:
+        by_shard.setdefault(shard_for(row['card_number'], shards), []) \
+            .append((line, row))
+    inserted, skipped, errors = 0, 0, []
+    for shard, shard_rows in by_shard.items():
+        with engines[shard].begin() as connection:
+            result = load_chunk(connection, collection, shard_rows, import_id)
+        inserted += result[0]
+        skipped += result[1]
+        errors += result[2]
+    return inserted, skipped, errors
+
+
+def _init_worker(database_uris, database_name, collection_name):
+    global _worker_engines, _worker_collection
+    _worker_engines = {shard: create_engine(uri, pool_size=1,
+                                            pool_pre_ping=True)
+                       for shard, uri in database_uris.items()}
+    _worker_collection = get_mongo_client()[database_name][collection_name]
+
+
+def _load_chunk_in_worker(rows, import_id):
+    return load_sharded(_worker_engines, _worker_collection, rows, import_id)
+
+
+def _chunks(path, chunk_size, after_line):
+    """
+    Stream validated rows in chunks of (last_line, rows, errors).
+    Rows up to after_line were loaded by an earlier run; they are still
+    read so that duplicates within the file are caught.
+    """
+    seen = {}
+    rows, errors, last_line = [], [], after_line
+    for line, record in iter_rows(path):
+        resumed = line <= after_line
+        try:
+            row = validate_row(record)
+            card = row['card_number']
+            if card in seen:
+                raise BadRequest(
+                    f'card_number repeats line {seen[card]} of the file')
+            seen[card] = line
+        except BadRequest as e:
+            if not resumed:
+                errors.append((line, record.get('card_number'), e.description))
+                last_line = line
+            continue
+        if resumed:
+            continue
+        rows.append((line, row))
+        last_line = line
+        if len(rows) + len(errors) >= chunk_size:
+            yield last_line, rows, errors
+            rows, errors = [], []
+    if rows or errors:
+        yield last_line, rows, errors
+
+
+def import_users(path, chunk_size=1000, workers=1, errors_path=None,
+                 restart=False, on_progress=None):
+    """
+    Register every user in a CSV or XLSX file in both stores.
+    Rows are validated and deduplicated in this process and loaded chunk
+    by chunk, each row on the shard its card number maps to, across a
+    process pool when workers > 1. The last line below
+    which every chunk has committed is checkpointed, so an interrupted
+    import of the same file resumes from there. Rejected rows are written
+    to errors_path (CSV).
+    Must be called inside an application context.
+    """
+    stat = os.stat(path)
+    import_id = hashlib.sha1(
+        f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        .encode('utf-8')).hexdigest()
+    checkpoint = Checkpoint(f'user_import:{import_id}')
+    if restart:
+        checkpoint.clear()
+    state = checkpoint.load() or {}
+    after_line = state.get('after_line', 1)
+
+    report = ImportReport(path)
+    started = time.monotonic()
+    errors_path = errors_path or f'{path}.errors.csv'
+    resuming = bool(state) and os.path.exists(errors_path)
+    with open(errors_path, 'a' if resuming else 'w', newline='') as error_file:
+        error_writer = csv.writer(error_file)
+        if not resuming:
+            error_writer.writerow(ERROR_COLUMNS)
+
+        def record(chunk, result):
+            last_line, rows, parse_errors = chunk
+            inserted, skipped, load_errors = result
+            failed = sorted(parse_errors + load_errors)
+            error_writer.writerows(failed)
+            error_file.flush()
+            report.rows += len(rows) + len(parse_errors)
+            report.inserted += inserted
+            report.skipped += skipped
+            report.errors += len(failed)
+            checkpoint.save({'after_line': last_line})
+            if on_progress:
+                on_progress(report)
+
+        chunks = _chunks(path, chunk_size, after_line)
+        if workers <= 1:
+            engines = {shard: db.engines[shard]
+                       for shard in shard_keys() or [None]}
+            for chunk in chunks:
+                record(chunk, load_sharded(engines, user_collection, chunk[1],
+                                           import_id))
+        else:
+            # Chunks finish out of order; only the contiguous prefix is durable
+            in_flight = []
+            with ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker,
+                    initargs=(shard_urls(), user_collection.database.name,
+                              user_collection.name)) as pool:
+                for chunk in chunks:
+                    in_flight.append(
+                        (chunk, pool.submit(_load_chunk_in_worker, chunk[1],
+                                            import_id)))
+                    if len(in_flight) >= workers * 2:
+                        # Bound memory by waiting for the oldest chunk
+                        in_flight[0][1].exception()
+                    _drain(in_flight, record)
+                while in_flight:
+                    wait([future for _, future in in_flight])
+                    _drain(in_flight, record)
+
+    report.seconds = time.monotonic() - started
+    checkpoint.clear()
+    return report
+
+
+def _drain(in_flight, record):
+    """
+    Record the finished chunks at the head of in_flight, in file order.
+    A failed chunk re-raises so the run stops there.
+    """
+    while in_flight and in_flight[0][1].done():
+        chunk, future = in_flight.pop(0)
+        record(chunk, future.result())
@@ -0,0 +1,270 @@
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import date, timedelta
+from sqlalchemy import (Date, and_, bindparam, create_engine, func, literal,
+                        select)
+import time
+
+from ..models import db
+from ..database.sharding import each_shard, shard_urls, use_shard
+from ..models.user import User, Wallet
+from ..models.contribution import ContributionPosting
+from .checkpoint import Checkpoint
+from .rollups import add_to_daily_totals
+
+users = User.__table__
+wallets = Wallet.__table__
+postings = ContributionPosting.__table__
+
+# Engine owned by each pool worker process, created by _init_worker
+_worker_engine = None
+
+
+class PostingReport:
+    """
+    Totals for one posting run
+    """
+    def __init__(self, run_date):
+        self.run_date = run_date.isoformat()
+        self.chunks = 0
+        self.wallets = 0
+        self.posted = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    @property
+    def wallets_per_second(self):
+        return self.wallets / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data['wallets_per_second'] = round(self.wallets_per_second, 1)
+        return data
+
+
+def _due_dates(next_due_on, run_date, balance, amount):
+    """
+    The days from next_due_on through run_date to post, stopping before
+    the first debit that would overdraw the wallet
+    """
+    days = []
+    day = next_due_on
+    while day <= run_date and balance + amount >= 0:
+        days.append(day)
+        balance += amount
+        day += timedelta(days=1)
+    return days
+
+
+def post_chunk(connection, wallet_ids, run_date):
+    """
+    Apply the contributions due up to run_date to the given wallets in the
+    caller's transaction.
+    Wallets due only on run_date whose balance covers the debit, the
+    usual case, are posted with set-based statements: one INSERT ...
+    SELECT into the ledger, one grouped rollup and one UPDATE.
+    A wallet whose next_due_on is behind run_date has every missed day
+    posted; debits stop at the first day that would overdraw the wallet,
+    and that day stays due for a later run. That needs a running balance
+    per wallet, so those catch-ups are computed here and written with one
+    batched insert and UPDATE.
+    Returns the number of wallets posted.
+    """
+    # Lock the chunk so concurrent balance changes cannot interleave
+    connection.execute(
+        select(wallets.c.id).where(wallets.c.id.in_(wallet_ids))
+        .with_for_update()
+    ).all()
+
+    due_today = and_(
+        wallets.c.id.in_(wallet_ids),
+        wallets.c.next_due_on == run_date,
+        wallets.c.daily_amount != 0,
+        func.coalesce(wallets.c.balance, 0) + wallets.c.daily_amount >= 0,
+    )
+    with_user = wallets.join(users, users.c.id == wallets.c.user_id)
+    totals = {
+        account_type: (amount, count)
+        for account_type, amount, count in connection.execute(
+            select(users.c.account_type, func.sum(wallets.c.daily_amount),
+                   func.count())
+            .select_from(with_user).where(due_today)
+            .group_by(users.c.account_type)
+        )
+    }
+    posted = 0
+    if totals:
+        # The ledger's primary key forbids a second posting for the same day
+        connection.execute(postings.insert().from_select(
+            ['wallet_id', 'posting_date', 'amount'],
+            select(wallets.c.id, literal(run_date, Date),
+                   wallets.c.daily_amount)
+            .select_from(with_user).where(due_today)
+        ))
+        posted = connection.execute(
+            wallets.update()
+            .where(
+                wallets.c.id.in_(wallet_ids),
+                wallets.c.next_due_on == run_date,
+                wallets.c.id.in_(
+                    select(postings.c.wallet_id)
+                    .where(postings.c.posting_date == run_date)
+                    .scalar_subquery()
+                ),
+            )
+            .values(
+                balance=wallets.c.balance + wallets.c.daily_amount,
+                next_due_on=run_date + timedelta(days=1),
+            )
+        ).rowcount
+        add_to_daily_totals(connection, run_date, totals)
+
+    behind = connection.execute(
+        select(wallets.c.id, wallets.c.daily_amount, wallets.c.balance,
+               wallets.c.next_due_on, users.c.account_type)
+        .select_from(with_user)
+        .where(
+            wallets.c.id.in_(wallet_ids),
+            wallets.c.next_due_on < run_date,
+            wallets.c.daily_amount != 0,
+        )
+    ).all()
+
+    ledger, updates, totals = [], [], {}
+    for wallet_id, amount, balance, next_due_on, account_type in behind:
+        days = _due_dates(next_due_on, run_date, balance or 0.0, amount)
+        if not days:
+            continue
+        ledger += [{'wallet_id': wallet_id, 'posting_date': day, 'amount': amount}
+                   for day in days]
+        updates.append({'b_id': wallet_id, 'b_delta': amount * len(days),
+                        'b_next_due_on': days[-1] + timedelta(days=1)})
+        for day in days:
+            day_totals = totals.setdefault(day, {})
+            total, count = day_totals.get(account_type, (0.0, 0))
+            day_totals[account_type] = (total + amount, count + 1)
+    if not updates:
+        return posted
+
+    connection.execute(postings.insert(), ledger)
+    connection.execute(
+        wallets.update()
+        .where(wallets.c.id == bindparam('b_id'))
+        .values(
+            balance=wallets.c.balance + bindparam('b_delta'),
+            next_due_on=bindparam('b_next_due_on'),
+        ),
+        updates
+    )
+    for day in sorted(totals):
+        add_to_daily_totals(connection, day, totals[day])
+    return posted + len(updates)
+
+
+def _init_worker(database_uri):
+    global _worker_engine
+    _worker_engine = create_engine(database_uri, pool_size=1,
+                                   pool_pre_ping=True)
+
+
+def _post_chunk_in_worker(wallet_ids, run_date):
+    with _worker_engine.begin() as connection:
+        return post_chunk(connection, wallet_ids, run_date)
+
+
+def _due_wallet_chunks(shard, run_date, chunk_size, after_id):
+    """
+    Stream ids of one shard's wallets due on run_date, chunk by chunk in
+    id order
+    """
+    while True:
+        with use_shard(shard):
+            query = db.session.query(Wallet.id).filter(
+                Wallet.next_due_on <= run_date,
+                Wallet.daily_amount != 0,
+            )
+            if after_id is not None:
+                query = query.filter(Wallet.id > after_id)
+            ids = [row[0] for row in query.order_by(Wallet.id).limit(chunk_size)]
+            db.session.commit()
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def run_daily_posting(run_date=None, chunk_size=1000, workers=1,
+                      restart=False, on_progress=None):
+    """
+    Post the daily contribution for every due wallet, one shard after
+    another. Due wallets are streamed in id order and posted chunk by
+    chunk, across a process pool when workers > 1. The highest id below
+    which every chunk has committed is checkpointed per shard, so a
+    crashed run resumes from there; re-posting is prevented by
+    next_due_on and the ledger key.
+    Must be called inside an application context.
+    """
+    run_date = run_date or date.today()
+    report = PostingReport(run_date)
+    started = time.monotonic()
+    for shard in each_shard():
+        _post_shard(shard, run_date, chunk_size, workers, restart, report,
+                    on_progress)
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def _post_shard(shard, run_date, chunk_size, workers, restart, report,
+                on_progress):
+    name = f'contribution_posting:{run_date.isoformat()}'
+    checkpoint = Checkpoint(f'{name}:{shard}' if shard else name)
+    if restart:
+        checkpoint.clear()
+    after_id = (checkpoint.load() or {}).get('after_id')
+
+    def record(chunk, posted):
+        report.chunks += 1
+        report.wallets += len(chunk)
+        report.posted += posted
+        report.skipped += len(chunk) - posted
+        if on_progress:
+            on_progress(report)
+
+    chunks = _due_wallet_chunks(shard, run_date, chunk_size, after_id)
+    if workers <= 1:
+        for chunk in chunks:
+            with db.engines[shard].begin() as connection:
+                posted = post_chunk(connection, chunk, run_date)
+            record(chunk, posted)
+            checkpoint.save({'after_id': chunk[-1]})
+    else:
+        database_uri = shard_urls()[shard]
+        # Chunks finish out of order; only the contiguous prefix is durable
+        in_flight = []
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(database_uri,)) as pool:
+            for chunk in chunks:
+                in_flight.append(
+                    (chunk, pool.submit(_post_chunk_in_worker, chunk, run_date)))
+                if len(in_flight) >= workers * 2:
+                    # Bound memory by waiting for the oldest chunk
+                    in_flight[0][1].exception()
+                after_id = _drain(in_flight, record, after_id)
+                checkpoint.save({'after_id': after_id})
+            while in_flight:
+                wait([future for _, future in in_flight])
+                after_id = _drain(in_flight, record, after_id)
+                checkpoint.save({'after_id': after_id})
+    checkpoint.clear()
+
+
+def _drain(in_flight, record, after_id):
+    """
+    Pop the finished chunks at the head of in_flight and return the new
+    low-water mark. A failed chunk re-raises so the run stops there.
+    """
+    while in_flight and in_flight[0][1].done():
+        chunk, future = in_flight.pop(0)
+        record(chunk, future.result())
+        after_id = chunk[-1]
+    return after_id
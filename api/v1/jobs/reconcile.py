@@ -0,0 +1,266 @@
+from pymongo import UpdateOne
+from sqlalchemy import func
+import time
+import zlib
+
+from ..config import BINARY_UUID_KEYS
+from ..models import db, user_collection
+from ..database.sharding import each_shard, use_shard
+from ..models.user import User
+from .checkpoint import Checkpoint
+
+# (MySQL column, MongoDB field) pairs that both stores are expected to hold
+MIRRORED_FIELDS = (
+    ('id', 'id'),
+    ('full_name', 'fullName'),
+    ('card_number', 'card_number'),
+    ('phone_number', 'phone_number'),
+)
+# Mongo field holding mirror_checksum() of the document
+CHECKSUM_FIELD = 'mirror_crc'
+SEPARATOR = '\x1f'
+
+
+class ReconcileReport:
+    """
+    Running totals for one reconciliation pass
+    """
+    def __init__(self):
+        self.batches = 0
+        self.identical_batches = 0
+        self.rows_checked = 0
+        self.missing = 0
+        self.orphaned = 0
+        self.mismatched = 0
+        self.repaired = 0
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def mirror_checksum(document):
+    """
+    CRC32 of a MongoDB user's mirrored fields, as the MySQL digest computes
+    it for the row. Every write of those fields stores it in the document
+    as CHECKSUM_FIELD, so MongoDB can sum a range without sending it.
+    """
+    return _checksum(document.get(field) for _, field in MIRRORED_FIELDS)
+
+
+def _checksum(values):
+    text = SEPARATOR.join('' if value is None else str(value)
+                          for value in values)
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def _in_range(query, after_id, upto_id):
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    if upto_id is not None:
+        query = query.filter(User.id <= upto_id)
+    return query
+
+
+def _range_end(after_id, batch_size):
+    """
+    Upper id of the range after after_id: the lowest of every shard's
+    batch_size-th next id, so no shard has more than batch_size users in
+    the range. None once every shard has fewer left; the last range is
+    open-ended to catch trailing orphans.
+    """
+    ends = []
+    for shard in each_shard():
+        with use_shard(shard):
+            end = _in_range(User.query.with_entities(User.id), after_id, None) \
+                .order_by(User.id).offset(batch_size - 1).limit(1).scalar()
+        if end is not None:
+            ends.append(end)
+    return min(ends) if ends else None
+
+
+def _sql_digest(after_id, upto_id):
+    """
+    (users, sum of their checksums) in the range. MySQL computes it with
+    one aggregate per shard; other databases have no CRC32, so their rows
+    are read and summed here.
+    """
+    count, total = 0, 0
+    for shard in each_shard():
+        with use_shard(shard):
+            query = _in_range(User.query, after_id, upto_id)
+            if db.session.get_bind(User.__mapper__).dialect.name != 'mysql':
+                for row in query.with_entities(*_mirrored_columns()):
+                    count += 1
+                    total += _checksum(row)
+                continue
+            key = func.bin_to_uuid(User.id) if BINARY_UUID_KEYS else User.id
+            text = func.concat_ws(SEPARATOR, *[
+                func.coalesce(column, '')
+                for column in [key] + _mirrored_columns()[1:]
+            ])
+            shard_count, shard_total = query.with_entities(
+                func.count(), func.sum(func.crc32(text))).one()
+        count += shard_count
+        total += int(shard_total or 0)
+    return count, total
+
+
+def _mongo_digest(after_id, upto_id):
+    """
+    (documents, sum of their stored checksums) in the range, from a $group
+    """
+    result = list(user_collection.aggregate([
+        {'$match': _mongo_bounds(after_id, upto_id)},
+        {'$group': {'_id': None, 'count': {'$sum': 1},
+                    'total': {'$sum': '$' + CHECKSUM_FIELD}}},
+    ]))
+    if not result:
+        return 0, 0
+    return result[0]['count'], result[0]['total']
+
+
+def _mirrored_columns():
+    return [getattr(User, column) for column, _ in MIRRORED_FIELDS]
+
+
+def _sql_range(after_id, upto_id):
+    """
+    Mirrored columns of the users in the range, from every shard
+    """
+    rows = []
+    for shard in each_shard():
+        with use_shard(shard):
+            query = _in_range(User.query.with_entities(*_mirrored_columns()),
+                              after_id, upto_id)
+            rows += [tuple(row) for row in query]
+    return rows
+
+
+def _mongo_bounds(after_id, upto_id):
+    bounds = {}
+    if after_id is not None:
+        bounds['$gt'] = after_id
+    if upto_id is not None:
+        bounds['$lte'] = upto_id
+    return {'id': bounds} if bounds else {'id': {'$exists': True}}
+
+
+def _mongo_range(after_id, upto_id):
+    """
+    {id: (mirrored fields, stored checksum)} of the Mongo documents with
+    after_id < id <= upto_id (either end may be open)
+    """
+    projection = {field: 1 for _, field in MIRRORED_FIELDS}
+    projection[CHECKSUM_FIELD] = 1
+    projection['_id'] = 0
+    return {
+        doc.get('id'): (tuple(doc.get(field) for _, field in MIRRORED_FIELDS),
+                        doc.get(CHECKSUM_FIELD))
+        for doc in user_collection.find(_mongo_bounds(after_id, upto_id),
+                                        projection)
+    }
+
+
+def _repair(missing_or_stale, orphaned):
+    """
+    Make MongoDB match MySQL for the given rows; MySQL is the source of truth
+    """
+    repaired = 0
+    if missing_or_stale:
+        operations = [
+            UpdateOne(
+                {'id': row[0]},
+                {'$set': {
+                    **{field: value for (_, field), value
+                       in zip(MIRRORED_FIELDS, row)},
+                    CHECKSUM_FIELD: _checksum(row),
+                }},
+                upsert=True
+            )
+            for row in missing_or_stale
+        ]
+        user_collection.bulk_write(operations, ordered=False)
+        repaired += len(operations)
+    if orphaned:
+        result = user_collection.delete_many({'id': {'$in': orphaned}})
+        repaired += result.deleted_count
+    return repaired
+
+
+def reconcile_users(batch_size=500, repair=False, pause=0.0, restart=False,
+                    full=False, on_issue=None):
+    """
+    Walk MySQL users and their MongoDB mirror in id order, one bounded
+    range at a time. Each store sums the checksums of the range itself;
+    ranges whose sums agree are skipped, and only the rest are read in
+    full, diffed, reported and optionally repaired. MongoDB's sum comes
+    from the checksums its writers stored, so full=True diffs every range
+    to also catch documents edited behind the API's back.
+    Progress is checkpointed after every batch so an interrupted run
+    resumes where it stopped.
+    Must be called inside an application context.
+    """
+    checkpoint = Checkpoint('reconcile_users')
+    if restart:
+        checkpoint.clear()
+    state = checkpoint.load() or {}
+    after_id = state.get('after_id')
+    report = ReconcileReport()
+
+    # Range scans on the Mongo side need an index on the mirrored id
+    user_collection.create_index('id')
+
+    while True:
+        upto_id = _range_end(after_id, batch_size)
+        sql_digest = _sql_digest(after_id, upto_id)
+        mongo_digest = _mongo_digest(after_id, upto_id)
+        if not sql_digest[0] and not mongo_digest[0]:
+            break
+
+        report.batches += 1
+        report.rows_checked += sql_digest[0]
+
+        if not full and sql_digest == mongo_digest:
+            report.identical_batches += 1
+        else:
+            mongo_by_id = _mongo_range(after_id, upto_id)
+            sql_ids = set()
+            stale = []
+            for row in _sql_range(after_id, upto_id):
+                sql_ids.add(row[0])
+                mongo_row, checksum = mongo_by_id.get(row[0], (None, None))
+                if mongo_row is None:
+                    report.missing += 1
+                    kind = 'missing'
+                elif mongo_row != row:
+                    report.mismatched += 1
+                    kind = 'mismatched'
+                else:
+                    if checksum != _checksum(row):
+                        # Same values, checksum absent or outdated: restamp
+                        # it so the range compares equal next time
+                        stale.append(row)
+                    continue
+                stale.append(row)
+                if on_issue:
+                    on_issue(kind, row[0])
+
+            orphaned = [user_id for user_id in mongo_by_id
+                        if user_id not in sql_ids]
+            report.orphaned += len(orphaned)
+            if on_issue:
+                for user_id in orphaned:
+                    on_issue('orphaned', user_id)
+
+            if repair:
+                report.repaired += _repair(stale, orphaned)
+
+        if upto_id is None:
+            break
+        after_id = upto_id
+        checkpoint.save({'after_id': after_id})
+        if pause:
+            time.sleep(pause)
+
+    checkpoint.clear()
+    return report
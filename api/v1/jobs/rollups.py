@@ -0,0 +1,92 @@
+from datetime import timedelta
+from sqlalchemy import func, select
+
+from ..models import db
+from ..database.sharding import each_shard, use_shard
+from ..models.user import User, Wallet
+from ..models.contribution import ContributionPosting, ContributionDailyTotal
+
+daily_totals = ContributionDailyTotal.__table__
+postings = ContributionPosting.__table__
+
+
+def _upsert(connection):
+    """
+    INSERT statement for daily_totals that adds to an existing row
+    """
+    if connection.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(daily_totals)
+        return stmt.on_duplicate_key_update(
+            total_amount=daily_totals.c.total_amount + stmt.inserted.total_amount,
+            postings=daily_totals.c.postings + stmt.inserted.postings,
+        )
+    from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(daily_totals)
+    return stmt.on_conflict_do_update(
+        index_elements=['day', 'account_type'],
+        set_={
+            'total_amount': daily_totals.c.total_amount + stmt.excluded.total_amount,
+            'postings': daily_totals.c.postings + stmt.excluded.postings,
+        }
+    )
+
+
+def add_to_daily_totals(connection, day, totals):
+    """
+    Fold {account_type: (amount, postings)} for one day into the rollup,
+    inside the caller's transaction
+    """
+    if not totals:
+        return
+    # A fixed row order keeps concurrent posting workers from deadlocking
+    connection.execute(_upsert(connection), [
+        {'day': day, 'account_type': account_type,
+         'total_amount': amount, 'postings': count}
+        for account_type, (amount, count) in sorted(
+            (account_type or '', total)
+            for account_type, total in totals.items())
+    ])
+
+
+def rebuild_daily_totals(day):
+    """
+    Recompute one day's rollup rows from the posting ledger, on every
+    shard from that shard's own postings. Returns the number of rows
+    written.
+    """
+    written = 0
+    for shard in each_shard():
+        with use_shard(shard):
+            rows = db.session.execute(
+                select(User.account_type, func.sum(ContributionPosting.amount),
+                       func.count())
+                .select_from(ContributionPosting)
+                .join(Wallet, Wallet.id == ContributionPosting.wallet_id)
+                .join(User, User.id == Wallet.user_id)
+                .where(ContributionPosting.posting_date == day)
+                .group_by(User.account_type)
+            ).all()
+            db.session.execute(
+                daily_totals.delete().where(daily_totals.c.day == day))
+            if rows:
+                db.session.execute(daily_totals.insert(), [
+                    {'day': day, 'account_type': account_type or '',
+                     'total_amount': amount or 0.0, 'postings': count}
+                    for account_type, amount, count in rows
+                ])
+            db.session.commit()
+        written += len(rows)
+    return written
+
+
+def backfill_daily_totals(start, end, on_day=None):
+    """
+    Rebuild the rollup for every day from start to end inclusive
+    """
+    day = start
+    while day <= end:
+        groups = rebuild_daily_totals(day)
+        if on_day:
+            on_day(day, groups)
+        day += timedelta(days=1)
@@ -2,13 +2,13 @@ from ..database.mysql import db
 from ..database.mongodb import get_mongo_client
 from ..config import config
 from os import environ
-from uuid import uuid4
+from .types import UUIDKey, new_id
 
 
 class BaseModel(db.Model):
     __abstract__ = True
 
-    id = db.Column(db.String(36), primary_key=True)
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     created_at = db.Column(db.DateTime, default=db.func.now())
     updated_on = db.Column(
         db.DateTime,
@@ -17,10 +17,15 @@ class BaseModel(db.Model):
     )
 
     def __init__(self):
-        self.id = str(uuid4())
+        self.id = new_id()
 
 
 mongod_client = get_mongo_client()
 default_collection = mongod_client[config[environ.get('FLASK_ENV', 'development')].MONGO_URI.split('/')[-1]]  # noqa: E501
 user_collection = default_collection['users']
 deleted_user_collection = default_collection['deleted_user']
+deleted_user_archive_collection = default_collection['deleted_user_archive']
+job_checkpoint_collection = default_collection['job_checkpoints']
+idempotency_collection = default_collection['idempotency_keys']
+revoked_token_collection = default_collection['revoked_tokens']
+primary_sticky_collection = default_collection['primary_sticky']
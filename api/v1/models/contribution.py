@@ -0,0 +1,38 @@
+from . import db
+from .types import UUIDKey
+
+
+class ContributionPosting(db.Model):
+    """
+    One scheduled contribution applied to a wallet on a given day.
+    The primary key makes a second posting for the same day impossible.
+    """
+    __tablename__ = 'contribution_postings'
+    __table_args__ = (
+        db.Index('ix_contribution_postings_posting_date', 'posting_date'),
+    )
+
+    wallet_id = db.Column(UUIDKey, db.ForeignKey('wallets.id', ondelete='CASCADE'), primary_key=True)
+    posting_date = db.Column(db.Date, primary_key=True)
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+    def __repr__(self):
+        return f"<ContributionPosting(wallet_id='{self.wallet_id}', posting_date='{self.posting_date}')>"
+
+
+class ContributionDailyTotal(db.Model):
+    """
+    Running total of the contributions posted per day and account type,
+    kept up to date by the posting run
+    """
+    __tablename__ = 'contribution_daily_totals'
+
+    day = db.Column(db.Date, primary_key=True)
+    account_type = db.Column(db.String(120), primary_key=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    postings = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
+
+    def __repr__(self):
+        return f"<ContributionDailyTotal(day='{self.day}', account_type='{self.account_type}')>"
@@ -0,0 +1,93 @@
+from sqlalchemy.types import BINARY, String, TypeDecorator
+import os
+import threading
+import time
+import uuid
+
+from ..config import BINARY_UUID_KEYS
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def uuid7():
+    """
+    Time-ordered UUID (RFC 9562 version 7): a 48-bit millisecond timestamp,
+    a 12-bit sequence that keeps ids monotonic within a millisecond, and
+    62 random bits. New keys therefore land on the right edge of an index.
+    """
+    global _last_ms, _sequence
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms <= _last_ms:
+            ms = _last_ms
+            _sequence += 1
+            if _sequence > 0xFFF:
+                ms += 1
+                _sequence = 0
+        else:
+            # Random start, leaving headroom for ids in the same millisecond
+            _sequence = int.from_bytes(os.urandom(2), 'big') & 0x7FF
+        _last_ms = ms
+        sequence = _sequence
+    random_bits = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    return uuid.UUID(int=(ms & ((1 << 48) - 1)) << 80 | 0x7 << 76
+                     | sequence << 64 | 0b10 << 62 | random_bits)
+
+
+def new_id():
+    """
+    Primary key for a new row, as the canonical string used by the API
+    """
+    return str(uuid7())
+
+
+class UUIDKey(TypeDecorator):
+    """
+    UUID key column that always reads and writes canonical strings.
+    Stored as BINARY(16) when BINARY_UUID_KEYS is enabled, otherwise as
+    the original 36 character string.
+    """
+    impl = String(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if BINARY_UUID_KEYS:
+            return dialect.type_descriptor(BINARY(16))
+        return dialect.type_descriptor(String(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not BINARY_UUID_KEYS:
+            return value
+        try:
+            return uuid.UUID(str(value)).bytes
+        except ValueError:
+            # Not a UUID (e.g. a card number probed as an id): match nothing
+            return str(value).encode('utf-8')[:16].ljust(16, b'\0')
+
+    def process_result_value(self, value, dialect):
+        if value is None or not BINARY_UUID_KEYS:
+            return value
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+class BinaryString(TypeDecorator):
+    """
+    String column compared by code point (utf8mb4_bin on MySQL, "C" on
+    PostgreSQL), so the database orders it exactly as Python orders str.
+    Needed where rows from several shards are merged in Python.
+    """
+    impl = String
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        length = self.impl.length
+        if dialect.name == 'mysql':
+            from sqlalchemy.dialects.mysql import VARCHAR
+            return dialect.type_descriptor(
+                VARCHAR(length, charset='utf8mb4', collation='utf8mb4_bin'))
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(String(length, collation='C'))
+        # SQLite compares by code point already
+        return dialect.type_descriptor(String(length))
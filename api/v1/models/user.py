@@ -1,35 +1,66 @@
 from werkzeug.exceptions import BadRequest
 from sqlalchemy.exc import IntegrityError
 from . import db, BaseModel
+from .types import BinaryString, UUIDKey, new_id
+from ..views.tracing import tracer
 from bson import ObjectId
-from uuid import uuid4
 from datetime import datetime
 from sqlalchemy.orm import validates
+import re
 
 # Association tables
 
 user_wallet = db.Table('user_wallet',
-db.Column('user_id', db.String(36), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
-db.Column('wallet_id', db.String(36), db.ForeignKey('wallets.id', ondelete='CASCADE'), primary_key=True)
+db.Column('user_id', UUIDKey, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+db.Column('wallet_id', UUIDKey, db.ForeignKey('wallets.id', ondelete='CASCADE'), primary_key=True)
 )
 
 
+def normalize_phone(phone_number):
+    """
+    Reduce a phone number to its digits so it can be prefix-searched
+    """
+    if not phone_number:
+        return None
+    return re.sub(r'\D', '', str(phone_number)) or None
+
+
+def normalize_name(full_name):
+    """
+    Case-folded name, so it can be prefix-searched without regard to case
+    """
+    if not full_name:
+        return None
+    return str(full_name).casefold()
+
 
 class User(BaseModel):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Prefix search walks these in (value, id) order for keyset paging
+        db.Index('ix_users_name_normalized_id', 'name_normalized', 'id'),
+        db.Index('ix_users_phone_normalized_id', 'phone_normalized', 'id'),
+    )
 
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid4()))
+    id = db.Column(UUIDKey, primary_key=True, default=new_id)
     full_name = db.Column(db.String(80), nullable=False)
-    card_number = db.Column(db.String(120), nullable=False)
+    # The search columns sort by code point on every shard, the order in
+    # which their rows are merged
+    name_normalized = db.Column(BinaryString(160), nullable=True)
+    card_number = db.Column(db.String(120), nullable=False, unique=True)
     phone_number = db.Column(db.String(120), nullable=True)
+    phone_normalized = db.Column(BinaryString(32), nullable=True)
     account_type = db.Column(db.String(120), nullable=False)
     wallets = db.relationship('Wallet', secondary=user_wallet, back_populates='users')
+    # Wallets the user owns (wallets.user_id), the ownership the ledger uses
+    owned_wallets = db.relationship('Wallet', foreign_keys='Wallet.user_id',
+                                    viewonly=True)
     balance = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=db.func.now())
     updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
 
     def __init__(self, full_name=None, card_number=None, account_type=None, phone_number=None):
-        self.id = str(uuid4())
+        self.id = new_id()
         self.full_name = full_name
         self.card_number = card_number
         self.account_type = account_type
@@ -40,9 +71,20 @@ class User(BaseModel):
         'polymorphic_identity': 'user',
     }
 
+    @validates('full_name')
+    def _sync_name_normalized(self, key, full_name):
+        self.name_normalized = normalize_name(full_name)
+        return full_name
+
+    @validates('phone_number')
+    def _sync_phone_normalized(self, key, phone_number):
+        self.phone_normalized = normalize_phone(phone_number)
+        return phone_number
+
     def set_password(self, password):
         from .. import bcrypt
-        self.password = bcrypt.generate_password_hash(password)
+        with tracer.span('bcrypt.hash'):
+            self.password = bcrypt.generate_password_hash(password)
 
     def validate_data(self, data):
         if not data:
@@ -67,14 +109,17 @@ class User(BaseModel):
 class Wallet(BaseModel):
     __tablename__ = 'wallets'
 
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(UUIDKey, db.ForeignKey('users.id'), nullable=False)
     balance = db.Column(db.Float, default=0.0)
     card_number = db.Column(db.String(120), nullable=False)
-    user_account_type = db.relationship('User', secondary=user_wallet, back_populates='wallets')
+    # Scheduled contribution: positive credits the wallet, negative debits it
+    daily_amount = db.Column(db.Float, default=0.0)
+    next_due_on = db.Column(db.Date, nullable=True, index=True)
+    user_account_type = db.relationship('User', secondary=user_wallet, viewonly=True)
     created_at = db.Column(db.DateTime, default=db.func.now())
     updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
 
-    users = db.relationship('User', back_populates='wallets')
+    users = db.relationship('User', secondary=user_wallet, back_populates='wallets')
 
     __mapper_args__ = {
         'polymorphic_identity': 'wallet'
@@ -82,11 +127,19 @@ class Wallet(BaseModel):
 
     def __init__(self, user_id, card_number=None):
         from .. import bcrypt
-        self.id = str(uuid4())
+        self.id = new_id()
         self.user_id = user_id
         self.balance = 0.0
         self.card_number = card_number
+        self.daily_amount = 0.0
     
+    def schedule_contribution(self, amount, start_on):
+        """
+        Enrol the wallet in the daily posting run from start_on
+        """
+        self.daily_amount = amount
+        self.next_due_on = start_on
+
     def add_balance(self, amount):
         self.balance += amount
 
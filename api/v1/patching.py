@@ -0,0 +1,11 @@
+"""
+Imported before anything else in the package. Under the gevent worker
+model (SERVE_WORKER_CLASS=gevent, set by serve.py) the standard library is
+monkey patched here, before any module has imported socket, ssl or
+threading.
+"""
+from os import environ
+
+if environ.get('SERVE_WORKER_CLASS') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
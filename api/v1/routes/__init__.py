@@ -3,7 +3,13 @@ from flask import Blueprint
 root_route = Blueprint('root', __name__, url_prefix='/api/v1/')
 auth_route = Blueprint('auth', __name__, url_prefix='/api/v1/auth')
 user_route = Blueprint('user', __name__, url_prefix='/api/v1/user')
+report_route = Blueprint('report', __name__, url_prefix='/api/v1/reports')
+health_route = Blueprint('health', __name__, url_prefix='/api/v1/health')
+debug_route = Blueprint('debug', __name__, url_prefix='/api/v1/debug')
 
 from . import home  # noqa: F401 E402
 from . import auth  # noqa: F401 E402
 from . import user # noqa: F401 E402
+from . import report  # noqa: F401 E402
+from . import health  # noqa: F401 E402
+from . import debug  # noqa: F401 E402
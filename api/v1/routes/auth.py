@@ -3,20 +3,29 @@ from flask import jsonify, request, make_response
 from werkzeug.exceptions import BadRequest
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, unset_jwt_cookies, set_access_cookies
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity, unset_jwt_cookies, set_access_cookies
 from random import randint
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson.objectid import ObjectId
 
 from ..models import user_collection, db
 from ..models.user import User
+from ..database.sharding import shard_for, shard_of_user, use_shard
 from ..views.util import to_dict
 import bcrypt
 from ..views.verify_accout import send_ver_code, cleanup_expired_codes, is_verification_code_valid
+from ..views.rate_limit import limiter
+from ..views.revocation import revocation
+from ..views.write_behind import login_stamps
+from ..views.loader import user_loader
+from ..views.validation import validate_body
+from ..views.tracing import tracer
 
 
 
 @auth_route.route('/login', strict_slashes=False, methods=['POST'])
+@validate_body
+@limiter.limit('login', identity_field='email')
 def login():
     """
     Login a user
@@ -29,6 +38,9 @@ def login():
           required: true
           schema:
             id: login_request
+            required:
+                - email
+                - password
             properties:
                 email:
                     type: string
@@ -67,6 +79,8 @@ def login():
                     error:
                         type: string
                         description: Error message
+        429:
+            description: Too many login attempts from this address or for this email
         500:
             description: Internal Server Error
             schema:
@@ -92,33 +106,32 @@ def login():
         if user_type not in data_type:
             return jsonify({'error': 'Invalid user type'}), 500
 
-        # Query MySQL
-        try:
-            user = data_type[user_type].query.filter_by(email=mongodata['email']).one()
-        except NoResultFound:
-            return jsonify({'error': 'User not found in MySQL database'}), 401
-
-        # Verify password
-        if not bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8')):
-            return jsonify({'error': 'Invalid password'}), 401
-
-        # Update MongoDB
-        now = datetime.utcnow()
-        user_collection.update_one(
-            {'_id': mongodata['_id']},
-            {
-                '$set': {
-                    'last_login': now,
-                    'id': user.id
-                }
-            }
-        )
-
-        # Fetch additional data
-        roles = user.roles
-        permissions = set()
-        for role in roles:
-            permissions.update([perm.code for perm in role.permissions])
+        # Query MySQL on the shard holding the user's card number
+        if mongodata.get('card_number'):
+            shard = shard_for(mongodata['card_number'])
+        else:
+            shard = shard_of_user(mongodata.get('id'))
+        with use_shard(shard):
+            try:
+                user = data_type[user_type].query.filter_by(email=mongodata['email']).one()
+            except NoResultFound:
+                return jsonify({'error': 'User not found in MySQL database'}), 401
+
+            # Verify password
+            with tracer.span('bcrypt.checkpw'):
+                password_ok = bcrypt.checkpw(password.encode('utf-8'), user.password.encode('utf-8'))
+            if not password_ok:
+                return jsonify({'error': 'Invalid password'}), 401
+
+            # Update MongoDB; the stamp is written behind the response
+            now = datetime.utcnow()
+            login_stamps.set(mongodata['_id'], {'last_login': now, 'id': user.id})
+
+            # Fetch additional data
+            roles = user.roles
+            permissions = set()
+            for role in roles:
+                permissions.update([perm.code for perm in role.permissions])
 
         # Create access token
         access_token = create_access_token(identity=user.id)
@@ -155,6 +168,8 @@ def login():
 
 
 @auth_route.route('/verify_user', strict_slashes=False, methods=['POST'])
+@validate_body
+@limiter.limit('verify_user', identity_field='email')
 def verify_account():
     """
     Verify user account
@@ -179,8 +194,9 @@ def verify_account():
               format: email
               description: The email address of the buyer
             code:
-              type: string
-              description: The verification code
+              type: [string, integer]
+              pattern: '^[0-9]+$'
+              description: The verification code, as digits or a number
     responses:
       200:
         description: Account verified successfully
@@ -214,6 +230,8 @@ def verify_account():
             error:
               type: string
               description: Error message
+      429:
+        description: Too many verification attempts from this address or for this email
       500:
         description: Internal Server Error
         schema:
@@ -273,34 +291,31 @@ def logout():
                         description: Error message
     """
     try:
-        # Get the user's identity
-        mysql_user_id = get_jwt_identity()
-
-        if mysql_user_id is None:
-            return jsonify({'error': 'User is not logged in'}), 401
-
-        # Find the user in MongoDB using the MySQL user ID
-        mongodata = user_collection.find_one({'id': mysql_user_id})
-
-        if not mongodata:
-            user = User.query.get(mysql_user_id)
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
-            mongodata = user_collection.find_one({'fullname': user.fullname})
-            if not mongodata:
-                return jsonify({'error': 'User not found in MongoDB'}), 404
-
-
-        # Update last logout in MongoDB
-        user_collection.update_one(
-            {'_id': mongodata['_id']},
-            {'$set': {'last_logout': datetime.utcnow()}}
-        )
+        # Revoke the token itself until it would have expired anyway; this
+        # comes first so the token dies whatever happens below
+        claims = get_jwt()
+        expires_at = datetime.utcfromtimestamp(claims['exp']) if 'exp' in claims \
+            else datetime.utcnow() + timedelta(days=1)
+        revocation.revoke(claims['jti'], expires_at)
 
         # Clear the JWT cookies
         response = make_response(jsonify({"message": "Successfully logged out"}))
         unset_jwt_cookies(response)
 
+        # Stamp the last logout in MongoDB, written behind the response
+        try:
+            mysql_user_id = get_jwt_identity()
+            mongodata = user_collection.find_one({'id': mysql_user_id})
+            if not mongodata:
+                with use_shard(shard_of_user(mysql_user_id)):
+                    user = User.query.get(mysql_user_id)
+                if user:
+                    mongodata = user_collection.find_one({'card_number': user.card_number})
+            if mongodata:
+                login_stamps.set(mongodata['_id'], {'last_logout': datetime.utcnow()})
+        except Exception as e:
+            print(f"Could not record logout: {str(e)}")
+
         return response, 200
 
     except Exception:
@@ -345,20 +360,18 @@ def get_status():
         if mysql_user_id is None:
             return jsonify({'error': 'User is not logged in'}), 401
 
-        user = User.query.get(mysql_user_id)
-        Owner = data_type[user.type].query.get(mysql_user_id)
-        roles = Owner.roles
-        permissions = []
-        for role in roles:
-            if role:
-                permissions.extend(perm.code for perm in role.permissions)
-        
-        mongodata = user_collection.find_one({
-            '$or': [
-                {'email': user.email},
-                {'id': user.id}
-            ]
-        })
+        # Every lookup of the user's rows goes to the shard holding them
+        with use_shard(shard_of_user(mysql_user_id)):
+            loader = user_loader()
+            user = loader.sql(('id', mysql_user_id))
+            Owner = data_type[user.type].query.get(mysql_user_id)
+            roles = Owner.roles
+            permissions = []
+            for role in roles:
+                if role:
+                    permissions.extend(perm.code for perm in role.permissions)
+
+        mongodata = loader.mongo(('email', user.email), ('id', user.id))
 
         if not mongodata:
             return jsonify({'error': 'User not found in MongoDB'}), 404
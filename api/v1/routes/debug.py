@@ -0,0 +1,169 @@
+from . import debug_route
+from flask import jsonify, request
+from werkzeug.exceptions import BadRequest
+
+from ..views.admin import admin_required
+from ..views.profiling import profiler, memory_stats
+
+
+def _int_arg(source, name, default):
+    try:
+        return int(source.get(name, default))
+    except (TypeError, ValueError):
+        raise BadRequest(f'{name} must be an integer')
+
+
+@debug_route.route('/memory', strict_slashes=False, methods=['GET'])
+@admin_required
+def memory():
+    """
+    Memory statistics of the worker
+    ---
+    tags:
+        - Debug
+    summary: RSS, GC and per-endpoint RSS growth of the answering worker
+    description: >
+        Admin only (X-Admin-Key). Every worker keeps its own numbers; the
+        pid in the response says which one answered.
+    responses:
+        200:
+            description: Statistics of this worker
+            schema:
+                type: object
+                properties:
+                    pid:
+                        type: integer
+                    rss_bytes:
+                        type: integer
+                    gc:
+                        type: object
+                    gauges:
+                        type: object
+                    endpoints:
+                        type: object
+                        description: requests, rss_growth_bytes and max_rss_growth_bytes per endpoint
+                    tracemalloc:
+                        type: object
+        403:
+            description: Admin access required
+    """
+    return jsonify({**memory_stats.stats(), 'tracemalloc': profiler.status()}), 200
+
+
+@debug_route.route('/memory/start', strict_slashes=False, methods=['POST'])
+@admin_required
+def start_tracing():
+    """
+    Start tracemalloc in the worker
+    ---
+    tags:
+        - Debug
+    summary: Start tracing allocations
+    description: >
+        Admin only. Takes the baseline snapshot that later snapshots can be
+        compared to. Allocations are slower until tracing is stopped.
+    parameters:
+        - in: body
+          name: body
+          required: false
+          schema:
+            type: object
+            properties:
+                frames:
+                    type: integer
+                    description: Stack frames kept per allocation (1 to 25, default 1)
+    responses:
+        200:
+            description: Tracing started
+        400:
+            description: Invalid frames, or tracing is already running
+        403:
+            description: Admin access required
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        return jsonify(profiler.start(_int_arg(body, 'frames', 1))), 200
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@debug_route.route('/memory/snapshot', strict_slashes=False, methods=['POST'])
+@admin_required
+def take_snapshot():
+    """
+    Snapshot the traced allocations
+    ---
+    tags:
+        - Debug
+    summary: Top allocation sites and the change since an earlier snapshot
+    description: >
+        Admin only. Needs tracing to have been started in the same worker;
+        check the pid.
+    parameters:
+        - in: query
+          name: limit
+          type: integer
+          required: false
+          description: Sites returned in top and diff (default 20, at most 100)
+        - in: query
+          name: group_by
+          type: string
+          required: false
+          enum: [lineno, filename, traceback]
+        - in: query
+          name: compare_to
+          type: string
+          required: false
+          enum: [previous, start]
+          description: Diff against the previous snapshot (default) or the start
+    responses:
+        200:
+            description: Snapshot statistics
+            schema:
+                type: object
+                properties:
+                    top:
+                        type: array
+                        items:
+                            type: object
+                    diff:
+                        type: array
+                        items:
+                            type: object
+        400:
+            description: Invalid parameters, or tracing is not running
+        403:
+            description: Admin access required
+    """
+    try:
+        limit = max(1, min(_int_arg(request.args, 'limit', 20), 100))
+        return jsonify(profiler.snapshot(
+            limit=limit,
+            group_by=request.args.get('group_by', 'lineno'),
+            compare_to=request.args.get('compare_to', 'previous'),
+        )), 200
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@debug_route.route('/memory/stop', strict_slashes=False, methods=['POST'])
+@admin_required
+def stop_tracing():
+    """
+    Stop tracemalloc in the worker
+    ---
+    tags:
+        - Debug
+    summary: Stop tracing allocations and drop the snapshots
+    responses:
+        200:
+            description: Tracing stopped
+        400:
+            description: Tracing is not running
+        403:
+            description: Admin access required
+    """
+    try:
+        return jsonify(profiler.stop()), 200
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
@@ -0,0 +1,78 @@
+from . import health_route
+from flask import current_app, jsonify
+
+from ..models import db
+from ..views.health import pool_stats, readiness
+
+
+@health_route.route('/live', strict_slashes=False, methods=['GET'])
+def live():
+    """
+    Liveness probe
+    ---
+    tags:
+        - Health
+    summary: The worker is up and serving requests
+    description: Touches no dependency, so it only fails if the worker is stuck.
+    responses:
+        200:
+            description: The worker is alive
+            schema:
+                type: object
+                properties:
+                    status:
+                        type: string
+    """
+    return jsonify({'status': 'ok'}), 200
+
+
+@health_route.route('/ready', strict_slashes=False, methods=['GET'])
+def ready():
+    """
+    Readiness probe
+    ---
+    tags:
+        - Health
+    summary: The worker can reach its databases
+    description: >
+        Pings MySQL (primary and replicas) and MongoDB with a short timeout.
+        Probe results are cached for HEALTH_CACHE_SECONDS; pool utilisation
+        is read fresh on every call.
+    responses:
+        200:
+            description: Every dependency answered
+            schema:
+                type: object
+                properties:
+                    status:
+                        type: string
+                    cached:
+                        type: boolean
+                    checked_at:
+                        type: string
+                    checks:
+                        type: object
+                        description: ok, latency_ms and error per dependency
+                    pools:
+                        type: object
+                        description: Connection pool utilisation per SQL engine
+                    jwt_decode_cache:
+                        type: object
+        503:
+            description: A dependency failed or timed out; same body
+    """
+    result, cached = readiness.check()
+    body = {
+        'status': 'ready' if result['ready'] else 'unavailable',
+        'cached': cached,
+        'checked_at': result['checked_at'],
+        'checks': result['checks'],
+        'pools': {
+            'mysql' if key is None else f'mysql_{key}': pool_stats(engine)
+            for key, engine in db.engines.items()
+        },
+    }
+    jwt_manager = current_app.extensions.get('flask-jwt-extended')
+    if hasattr(jwt_manager, 'decode_cache'):
+        body['jwt_decode_cache'] = jwt_manager.decode_cache.stats()
+    return jsonify(body), 200 if result['ready'] else 503
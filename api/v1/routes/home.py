@@ -6,6 +6,28 @@ from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import BadRequest
 from flask_jwt_extended import jwt_required
 from ..models import db, deleted_user_collection, user_collection
+from ..views.util import parse_fields
+from ..database.mongodb import for_reads
+from ..database.sharding import scatter_gather
+
+
+# Allow-lists for ?fields= (MySQL) and ?mongo_fields= (MongoDB)
+SQL_USER_FIELDS = {
+    'id': User.id,
+    'full_name': User.full_name,
+    'card_number': User.card_number,
+    'phone_number': User.phone_number,
+    'account_type': User.account_type,
+    'balance': User.balance,
+    'created_at': User.created_at,
+    'updated_at': User.updated_at,
+}
+SQL_USER_DEFAULT_FIELDS = ['id', 'created_at', 'updated_at']
+
+MONGO_USER_FIELDS = ['id', 'fullName', 'card_number', 'phone_number',
+                     'account_type', 'email', 'role', 'created_at',
+                     'updated_at']
+MONGO_USER_DEFAULT_FIELDS = ['id', 'email', 'role', 'created_at', 'updated_at']
 
 
 @root_route.route('/', strict_slashes=False)
@@ -29,8 +51,19 @@ def index():
 @root_route.route('/users', strict_slashes=False)
 def all_user():
     """
-    This is the root route
+    List users from both MySQL and MongoDB
     ---
+    parameters:
+        - in: query
+          name: fields
+          required: false
+          type: string
+          description: Comma separated MySQL fields to return
+        - in: query
+          name: mongo_fields
+          required: false
+          type: string
+          description: Comma separated MongoDB fields to return
     responses:
         200:
             description: A simple message
@@ -42,27 +75,29 @@ def all_user():
                     status:
                     type: string
     """
-    users = User.query.all()
-    mongo_users = user_collection.find()
+    try:
+        fields = parse_fields(SQL_USER_FIELDS, SQL_USER_DEFAULT_FIELDS)
+        mongo_fields = parse_fields(MONGO_USER_FIELDS,
+                                    MONGO_USER_DEFAULT_FIELDS,
+                                    param='mongo_fields')
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Push the field lists down as a column select and a Mongo projection;
+    # every shard streams its users by id and the streams are merged
+    columns = [SQL_USER_FIELDS[field] for field in fields]
+    users = [row[1:] for row in scatter_gather(
+        lambda: User.query.with_entities(User.id, *columns).order_by(User.id),
+        key=lambda row: row[0])]
+    projection = {field: 1 for field in mongo_fields}
+    projection['_id'] = 0
+    mongo_users = for_reads(user_collection).find({}, projection)
     return jsonify(
         {
-            'users': [
-                {
-                    'id': user.id,
-                    'email': user.email,
-                    'role': user.role.name,
-                    'created_at': user.created_at,
-                    'updated_at': user.updated_at
-                } for user in users
-            ],
+            'users': [dict(zip(fields, user)) for user in users],
             'mongo_users': [
-                {
-                    'id': user.get("id"),
-                    'email': user.get("email"),
-                    'role': user.get("role"),
-                    'created_at': user.get("created_at"),
-                    'updated_at': user.get("updated_at")
-                } for user in mongo_users
+                {field: user.get(field) for field in mongo_fields}
+                for user in mongo_users
             ]
         }
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,260 @@
+from . import report_route
+from flask import current_app, jsonify, request, Response, stream_with_context
+from werkzeug.exceptions import BadRequest
+from datetime import date
+
+from ..models import db
+from ..database.sharding import each_shard, use_shard
+from ..models.contribution import ContributionPosting, ContributionDailyTotal
+from ..views.admin import admin_required
+from ..jobs.export import export_statements, EXPORT_FORMATS, ExportUnavailable
+
+
+def parse_day(name, default=None):
+    """
+    Read a YYYY-MM-DD query parameter
+    """
+    value = request.args.get(name)
+    if not value:
+        if default is None:
+            raise BadRequest(f'{name} is required')
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f'{name} must be a YYYY-MM-DD date')
+
+
+def parse_range(required=True):
+    start = parse_day('from') if required or request.args.get('from') else None
+    end = parse_day('to', default=date.today())
+    if start is None:
+        return None, end
+    if end < start:
+        raise BadRequest('to must not be before from')
+    if (end - start).days >= current_app.config['REPORT_MAX_DAYS']:
+        raise BadRequest(
+            f"Range must be at most {current_app.config['REPORT_MAX_DAYS']} days")
+    return start, end
+
+
+def _sum_by_day(rows):
+    """
+    Add up (day, account_type, total_amount, postings) rows from several
+    shards into one row per day and account type, in that order
+    """
+    totals = {}
+    for day, account_type, total_amount, postings in rows:
+        total, count = totals.get((day, account_type), (0.0, 0))
+        totals[(day, account_type)] = (total + total_amount, count + postings)
+    return [(day, account_type, total, count) for (day, account_type), (total, count)
+            in sorted(totals.items(), key=lambda item: (item[0][0], item[0][1] or ''))]
+
+
+@report_route.route('/contributions', strict_slashes=False, methods=['GET'])
+@admin_required
+def contribution_report():
+    """
+    Contribution totals over a date range
+    ---
+    tags:
+        - Reports
+    summary: Contribution totals per day
+    description: >
+        Totals per day and account type, answered from the daily rollup.
+        With wallet_id, totals per day for that wallet from the posting
+        ledger. Requires the X-Admin-Key header.
+    parameters:
+        - in: header
+          name: X-Admin-Key
+          required: true
+          type: string
+        - in: query
+          name: from
+          required: true
+          type: string
+          format: date
+        - in: query
+          name: to
+          required: false
+          type: string
+          format: date
+          description: Defaults to today
+        - in: query
+          name: account_type
+          required: false
+          type: string
+        - in: query
+          name: wallet_id
+          required: false
+          type: string
+    responses:
+        200:
+            description: Totals for the range
+            schema:
+                type: object
+                properties:
+                    from:
+                        type: string
+                    to:
+                        type: string
+                    total_amount:
+                        type: number
+                    postings:
+                        type: integer
+                    days:
+                        type: array
+                        items:
+                            type: object
+                            properties:
+                                day:
+                                    type: string
+                                account_type:
+                                    type: string
+                                total_amount:
+                                    type: number
+                                postings:
+                                    type: integer
+        400:
+            description: Bad request
+            schema:
+                type: object
+                properties:
+                    error:
+                        type: string
+                        description: Error message
+        403:
+            description: Missing or wrong admin key
+    """
+    try:
+        start, end = parse_range()
+        wallet_id = request.args.get('wallet_id')
+        account_type = request.args.get('account_type')
+
+        # Every shard holds the ledger and rollup of its own wallets
+        rows = []
+        for shard in each_shard():
+            with use_shard(shard):
+                if wallet_id:
+                    # Range scan on the ledger's (wallet_id, posting_date) key
+                    rows += db.session.query(
+                        ContributionPosting.posting_date,
+                        db.literal(None),
+                        ContributionPosting.amount,
+                        db.literal(1),
+                    ).filter(
+                        ContributionPosting.wallet_id == wallet_id,
+                        ContributionPosting.posting_date.between(start, end),
+                    ).all()
+                else:
+                    query = db.session.query(
+                        ContributionDailyTotal.day,
+                        ContributionDailyTotal.account_type,
+                        ContributionDailyTotal.total_amount,
+                        ContributionDailyTotal.postings,
+                    ).filter(ContributionDailyTotal.day.between(start, end))
+                    if account_type:
+                        query = query.filter(
+                            ContributionDailyTotal.account_type == account_type)
+                    rows += query.all()
+        rows = _sum_by_day(rows)
+
+        days = [
+            {
+                'day': day.isoformat(),
+                'account_type': row_account_type,
+                'total_amount': total_amount,
+                'postings': postings,
+            }
+            for day, row_account_type, total_amount, postings in rows
+        ]
+        return jsonify({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'total_amount': sum(row['total_amount'] for row in days),
+            'postings': sum(row['postings'] for row in days),
+            'days': days,
+        }), 200
+
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'An unexpected error occurred'}), 500
+
+
+@report_route.route('/export', strict_slashes=False, methods=['GET'])
+@admin_required
+def export_statement():
+    """
+    Stream a member statement export
+    ---
+    tags:
+        - Reports
+    summary: Export users and wallet balances
+    description: >
+        Streams every wallet with its owner as CSV or Parquet straight from a
+        server-side cursor, so exports of any size use constant memory.
+        Requires the X-Admin-Key header.
+    produces:
+        - text/csv
+        - application/vnd.apache.parquet
+    parameters:
+        - in: header
+          name: X-Admin-Key
+          required: true
+          type: string
+        - in: query
+          name: format
+          required: false
+          type: string
+          enum: [csv, parquet]
+          description: Defaults to csv
+        - in: query
+          name: account_type
+          required: false
+          type: string
+        - in: query
+          name: from
+          required: false
+          type: string
+          format: date
+          description: Only wallets updated on or after this day
+        - in: query
+          name: to
+          required: false
+          type: string
+          format: date
+          description: Only wallets updated on or before this day (defaults to today)
+    responses:
+        200:
+            description: The export file
+        400:
+            description: Bad request
+            schema:
+                type: object
+                properties:
+                    error:
+                        type: string
+                        description: Error message
+        403:
+            description: Missing or wrong admin key
+    """
+    try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise BadRequest(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+        start, end = parse_range(required=False)
+        chunks = export_statements(export_format,
+                                   account_type=request.args.get('account_type'),
+                                   start=start, end=end)
+    except BadRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except ExportUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename=statement-{end.isoformat()}.{extension}'
+    return response
@@ -5,16 +5,149 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from flask_jwt_extended import create_access_token, set_access_cookies, jwt_required, get_jwt_identity
 from random import randint
-from datetime import datetime
 from bson.objectid import ObjectId
-from ..models import db, user_collection, deleted_user_collection
-from ..models.user import  User, Wallet
+from pymongo.errors import OperationFailure
+from ..models import db, user_collection
+from ..models.user import  User, Wallet, normalize_phone, normalize_name
+from ..database.sharding import (shard_keys, shard_for, use_shard, each_shard,
+                                 scatter_gather, shard_of_user, move_users)
+from sqlalchemy.orm import load_only, selectinload
 import bcrypt
+from itertools import islice
 from ..views.verify_accout import send_ver_code
+from ..views.idempotency import idempotent
+from ..jobs.reconcile import CHECKSUM_FIELD, mirror_checksum
+from ..views.validation import validate_body
+from ..views.loader import user_loader
+from ..views.archive import archive_user, archived_users
+from ..views.admin import admin_required
+from ..views.util import (parse_fields, make_etag, not_modified, with_etag,
+                          encode_cursor, decode_cursor, is_unique_violation)
 import traceback
 
 
+# Allow-lists for ?fields=, mapping response keys to the columns behind them
+USER_LIST_FIELDS = {
+  'id': User.id,
+  'fullName': User.full_name,
+  'card_number': User.card_number,
+  'phone_number': User.phone_number,
+  'account_type': User.account_type,
+  'balance': User.balance,
+  'created_at': User.created_at,
+  'updated_at': User.updated_at,
+}
+USER_LIST_DEFAULT_FIELDS = ['id', 'fullName', 'card_number', 'phone_number', 'account_type']
+
+USER_DETAIL_FIELDS = {
+  'id': User.id,
+  'full_name': User.full_name,
+  'card_number': User.card_number,
+  'phone_number': User.phone_number,
+  'account_type': User.account_type,
+  'balance': User.balance,
+  'created_at': User.created_at,
+  'updated_at': User.updated_at,
+}
+USER_DETAIL_DEFAULT_FIELDS = ['id', 'full_name', 'card_number', 'phone_number', 'account_type', 'balance']
+
+# update_user body keys, with the User attribute and MongoDB field each sets
+USER_UPDATE_FIELDS = {
+  'fullName': ('full_name', 'fullName'),
+  'card_number': ('card_number', 'card_number'),
+  'phone': ('phone_number', 'phone_number'),
+}
+
+_user_indexes_ready = False
+
+
+def ensure_user_indexes():
+  """
+  Unique index behind the card_number upsert in register_user
+  """
+  global _user_indexes_ready
+  if _user_indexes_ready:
+    return
+  try:
+    user_collection.create_index('card_number', unique=True)
+  except OperationFailure as e:
+    # Existing duplicates block the build; the upsert still works without it
+    print(f"Could not create unique card_number index: {str(e)}")
+  _user_indexes_ready = True
+
+
+SEARCH_MIN_LENGTH = 2
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Wallets are returned as rows in this column order
+WALLET_SUMMARY_FIELDS = ['id', 'card_number', 'balance', 'daily_amount', 'next_due_on']
+WALLET_SUMMARY_MAX_USERS = 100
+
+
+def wallet_summaries(card_numbers):
+  """
+  Wallets and wallet totals of the users with the given card numbers, in
+  three queries per shard however many users and wallets there are: the
+  users, their wallets (selectinload) and one GROUP BY for the totals
+  """
+  shards = shard_keys()
+  by_shard = {}
+  for card_number in card_numbers:
+    by_shard.setdefault(shard_for(card_number, shards), []).append(card_number)
+
+  summaries = []
+  for shard, shard_card_numbers in by_shard.items():
+    with use_shard(shard):
+      summaries.extend(_wallet_summaries(shard_card_numbers))
+  return summaries
+
+
+def _wallet_summaries(card_numbers):
+  users = User.query.options(
+    load_only(User.id, User.full_name, User.card_number),
+    selectinload(User.owned_wallets).load_only(
+      *[getattr(Wallet, field) for field in WALLET_SUMMARY_FIELDS[1:]]),
+  ).filter(User.card_number.in_(card_numbers)).all()
+  if not users:
+    return []
+
+  totals = {
+    user_id: (count, balance, daily_amount)
+    for user_id, count, balance, daily_amount in db.session.query(
+      Wallet.user_id,
+      db.func.count(Wallet.id),
+      db.func.coalesce(db.func.sum(Wallet.balance), 0.0),
+      db.func.coalesce(db.func.sum(Wallet.daily_amount), 0.0),
+    ).filter(Wallet.user_id.in_([user.id for user in users]))
+    .group_by(Wallet.user_id)
+  }
+
+  summaries = []
+  for user in users:
+    count, balance, daily_amount = totals.get(user.id, (0, 0.0, 0.0))
+    summaries.append({
+      'id': user.id,
+      'full_name': user.full_name,
+      'card_number': user.card_number,
+      'wallet_count': count,
+      'total_balance': balance,
+      'total_daily_amount': daily_amount,
+      'wallets': [
+        [
+          getattr(wallet, field).isoformat()
+          if field == 'next_due_on' and wallet.next_due_on else getattr(wallet, field)
+          for field in WALLET_SUMMARY_FIELDS
+        ]
+        for wallet in sorted(user.owned_wallets, key=lambda wallet: wallet.id)
+      ],
+    })
+  return summaries
+
+
 @user_route.route('/user', strict_slashes=False, methods=['POST'])
+@validate_body
+@idempotent
 def register_user():
   """
   Register a new user
@@ -24,6 +157,11 @@ def register_user():
   summary: Register a new user
   description: Register a new user in the system
   parameters:
+      - in: header
+        name: Idempotency-Key
+        required: false
+        type: string
+        description: Unique key per logical request; retries with the same key replay the first response
       - in: body
         name: user
         description: The user registration information
@@ -33,7 +171,6 @@ def register_user():
           required:
             - fullName
             - card_number
-            - phone_number
             - account_type
           properties:
             fullName:
@@ -148,22 +285,6 @@ def register_user():
 
 
     user.validate_data(data)
-    # Extract data
-    if card_number:
-      duplicate_card_number = User.query.filter_by(card_number=card_number).first()
-      if duplicate_card_number:
-        return jsonify({'error': 'Card number already exists'}), 409
-
-    # Check for duplicate user in MongoDB
-    existing_user = user_collection.find_one({'card_number': card_number})
-    if existing_user:
-      return jsonify({
-      'error': 'Record already found, new card number or Phone Number required to proceed',
-      'code': 'usr409'
-    }), 409
-
-    # Assign values to user object
-    # user.fullName = generate_user_fullName()
 
     user.full_name = full_name
     user.phone_number = phone_number
@@ -173,25 +294,50 @@ def register_user():
     wallet.card_number = card_number
     wallet.user_id = user.id
 
-    # Add and commit to the database
-    db.session.add(user)
-    db.session.commit()
-
-    # Insert the user data in MongoDB
-    user_collection.insert_one({
-    'id': user.id,
-    'fullName': full_name,
-    'card_number': card_number,
-    'phone_number': phone_number,
-    'account_type': 'account_type',
-    })
+    # The unique card_number constraint rejects duplicates in the INSERT
+    # itself (IntegrityError below), so no look-up round trips are needed.
+    # The card number also picks the shard the user lives on.
+    with use_shard(shard_for(card_number)):
+      user.wallets.append(wallet)
+      db.session.add_all([user, wallet])
+      # Read before the commit expires it; a refresh outside the block
+      # would look on the wrong shard
+      user_id = user.id
+      db.session.commit()
+
+    # Mirror the user in MongoDB with one upsert keyed on card_number.
+    # $setOnInsert never touches an existing document: one already holding
+    # the card number is a conflict, and the SQL row is taken back out.
+    ensure_user_indexes()
+    document = {
+      'id': user_id,
+      'fullName': full_name,
+      'card_number': card_number,
+      'phone_number': phone_number,
+      'account_type': 'account_type',
+    }
+    document[CHECKSUM_FIELD] = mirror_checksum(document)
+    result = user_collection.update_one(
+      {'card_number': card_number},
+      {'$setOnInsert': document},
+      upsert=True
+    )
+    if result.upserted_id is None:
+      with use_shard(shard_for(card_number)):
+        db.session.delete(wallet)
+        db.session.delete(user)
+        db.session.commit()
+      return jsonify({
+        'error': 'Record already found, new card number or Phone Number required to proceed',
+        'code': 'usr409'
+      }), 409
 
     # Create access token
 
     response = jsonify({
       'message': 'User registered successfully',
       'user': {
-        'id': user.id,
+        'id': user_id,
         'fullName': full_name,
         'card_number': card_number,
         'phone_number': phone_number,
@@ -205,8 +351,12 @@ def register_user():
     return jsonify({'error': str(e)}), 400
   except IntegrityError as e:
     db.session.rollback()
-    print(e)
-    return jsonify({'error': 'Integrity Error Occured'}), 409
+    if not is_unique_violation(e):
+      return jsonify({'error': 'Bad Request: User missing a credential'}), 400
+    return jsonify({
+      'error': 'Record already found, new card number or Phone Number required to proceed',
+      'code': 'usr409'
+    }), 409
   except Exception as e:
     db.session.rollback()
     print(traceback.format_exc())
@@ -221,6 +371,14 @@ def get_all_users():
     - User
   summary: Get all users
   description: Get all users in the system
+  parameters:
+    - in: query
+      name: fields
+      required: false
+      type: string
+      description: >
+        Comma separated list of fields to return
+        (id, fullName, card_number, phone_number, account_type, balance, created_at, updated_at)
   responses:
     200:
       description: Users retrieved successfully
@@ -247,6 +405,10 @@ def get_all_users():
                 account_type:
                   type: string
                   description: The account type of the user
+      headers:
+        ETag:
+          type: string
+          description: Send back as If-None-Match to revalidate
       examples:
         application/json:
           {
@@ -260,6 +422,8 @@ def get_all_users():
               }
             ]
           }
+    304:
+      description: The list has not changed since the ETag in If-None-Match
     404:
       description: Record not found
       schema:
@@ -288,22 +452,36 @@ def get_all_users():
           }
   """
   try:
-    users = User.query.all()
+    fields = parse_fields(USER_LIST_FIELDS, USER_LIST_DEFAULT_FIELDS)
+
+    # A cheap aggregate identifies the list; answer 304 before loading rows
+    count, last_update = 0, None
+    for shard in each_shard():
+      with use_shard(shard):
+        shard_count, shard_update = User.query.with_entities(
+          db.func.count(User.id), db.func.max(User.updated_at)
+        ).one()
+      count += shard_count
+      if shard_update and (last_update is None or shard_update > last_update):
+        last_update = shard_update
+    etag = make_etag('users', count, last_update, *fields)
+    cached = not_modified(etag)
+    if cached:
+      return cached
+
+    # Select only the requested columns so no User objects are hydrated;
+    # each shard streams its users by id and the streams are merged
+    columns = [USER_LIST_FIELDS[field] for field in fields]
+    rows = scatter_gather(
+      lambda: User.query.with_entities(User.id, *columns).order_by(User.id),
+      key=lambda row: row[0])
+    users = [dict(zip(fields, row[1:])) for row in rows]
     if not users:
       return jsonify({'error': 'No users found'}), 404
 
-    users = [
-      {
-        'id': user.id,
-        'fullName': user.full_name,
-        'card_number': user.card_number,
-        'phone_number': user.phone_number,
-        'account_type': user.account_type,
-      }
-      for user in users
-    ]
-
-    return jsonify({'users': users}), 200
+    return with_etag(jsonify({'users': users}), etag), 200
+  except BadRequest as e:
+    return jsonify({'error': str(e)}), 400
   except Exception as e:
     print(f"Unexpected error: {str(e)}")
     return jsonify({'error': 'An unexpected error occurred'}), 500
@@ -324,6 +502,13 @@ def get_user(card_number):
       schema:
         type: string
         description: The card number of the user
+    - in: query
+      name: fields
+      required: false
+      type: string
+      description: >
+        Comma separated list of fields to return
+        (id, full_name, card_number, phone_number, account_type, balance, created_at, updated_at)
   responses:
     200:
       description: User retrieved successfully
@@ -354,6 +539,8 @@ def get_user(card_number):
             "phone_number": "123-456-7890",
             "account_type": "standard"
           }
+    304:
+      description: The user has not changed since the ETag in If-None-Match
     404:
       description: Record not found
       schema:
@@ -382,25 +569,229 @@ def get_user(card_number):
           }
   """
   try:
-    user = User.query.filter_by(card_number=card_number).first()
-    if not user:
+    fields = parse_fields(USER_DETAIL_FIELDS, USER_DETAIL_DEFAULT_FIELDS)
+
+    # id and updated_at ride along in the same select to build the ETag
+    with use_shard(shard_for(card_number)):
+      row = User.query.with_entities(
+        User.id, User.updated_at,
+        *[USER_DETAIL_FIELDS[field] for field in fields]
+      ).filter(User.card_number == card_number).first()
+    if not row:
       return jsonify({'error': 'User not found'}), 404
 
-    user = {
-      'id': user.id,
-      'full_name': user.full_name,
-      'card_number': user.card_number,
-      'phone_number': user.phone_number,
-      'account_type': user.account_type,
-      'balance': user.balance,
-    }
+    etag = make_etag(row[0], row[1], *fields)
+    cached = not_modified(etag)
+    if cached:
+      return cached
+
+    return with_etag(jsonify(dict(zip(fields, row[2:]))), etag), 200
+  except BadRequest as e:
+    return jsonify({'error': str(e)}), 400
+  except Exception as e:
+    print(f"Unexpected error: {str(e)}")
+    return jsonify({'error': 'An unexpected error occurred'}), 500
 
-    return jsonify(user), 200
+@user_route.route('/wallets/<string:card_number>', strict_slashes=False, methods=['GET'])
+def get_wallet_summary(card_number):
+  """
+  Wallet summary of a user
+  ---
+  tags:
+    - User
+  summary: A user's wallets and totals
+  description: >
+    Every wallet of the user as a row of wallet_fields, with the wallet
+    count and totals. Served in three queries however many wallets the
+    user has.
+  parameters:
+    - in: path
+      name: card_number
+      required: true
+      type: string
+      description: The card number of the user
+  responses:
+    200:
+      description: Wallet summaries
+      schema:
+        type: object
+        properties:
+          wallet_fields:
+            type: array
+            description: Column names of each row in wallets
+            items:
+              type: string
+          users:
+            type: array
+            items:
+              type: object
+              properties:
+                id:
+                  type: string
+                full_name:
+                  type: string
+                card_number:
+                  type: string
+                wallet_count:
+                  type: integer
+                total_balance:
+                  type: number
+                total_daily_amount:
+                  type: number
+                wallets:
+                  type: array
+                  items:
+                    type: array
+                    items: {}
+      examples:
+        application/json:
+          {
+            "wallet_fields": ["id", "card_number", "balance", "daily_amount", "next_due_on"],
+            "users": [
+              {
+                "id": "12345",
+                "full_name": "John Doe",
+                "card_number": "1234-5678-9012-3456",
+                "wallet_count": 1,
+                "total_balance": 1500.0,
+                "total_daily_amount": 500.0,
+                "wallets": [["67890", "1234-5678-9012-3456", 1500.0, 500.0, "2024-09-02"]]
+              }
+            ]
+          }
+    404:
+      description: Record not found
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+    500:
+      description: Unexpected internal server error
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+  """
+  try:
+    summaries = wallet_summaries([card_number])
+    if not summaries:
+      return jsonify({'error': 'User not found'}), 404
+    return jsonify({'wallet_fields': WALLET_SUMMARY_FIELDS, 'users': summaries}), 200
   except Exception as e:
     print(f"Unexpected error: {str(e)}")
     return jsonify({'error': 'An unexpected error occurred'}), 500
 
+
+@user_route.route('/wallets', strict_slashes=False, methods=['GET'])
+def get_wallet_summaries():
+  """
+  Wallet summaries of several users
+  ---
+  tags:
+    - User
+  summary: Wallets and totals for many users
+  description: >
+    The batched form of /wallets/{card_number}. Unknown card numbers are
+    left out. Served in three queries however many users and wallets are
+    requested.
+  parameters:
+    - in: query
+      name: card_numbers
+      required: true
+      type: string
+      description: Comma separated card numbers (at most 100)
+  responses:
+    200:
+      description: Wallet summaries
+      schema:
+        type: object
+        properties:
+          wallet_fields:
+            type: array
+            description: Column names of each row in wallets
+            items:
+              type: string
+          users:
+            type: array
+            items:
+              type: object
+              properties:
+                id:
+                  type: string
+                full_name:
+                  type: string
+                card_number:
+                  type: string
+                wallet_count:
+                  type: integer
+                total_balance:
+                  type: number
+                total_daily_amount:
+                  type: number
+                wallets:
+                  type: array
+                  items:
+                    type: array
+                    items: {}
+      examples:
+        application/json:
+          {
+            "wallet_fields": ["id", "card_number", "balance", "daily_amount", "next_due_on"],
+            "users": [
+              {
+                "id": "12345",
+                "full_name": "John Doe",
+                "card_number": "1234-5678-9012-3456",
+                "wallet_count": 1,
+                "total_balance": 1500.0,
+                "total_daily_amount": 500.0,
+                "wallets": [["67890", "1234-5678-9012-3456", 1500.0, 500.0, "2024-09-02"]]
+              }
+            ]
+          }
+    400:
+      description: Bad request due to missing or invalid input
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+    500:
+      description: Unexpected internal server error
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+  """
+  try:
+    card_numbers = list(dict.fromkeys(
+      card.strip() for card in request.args.get('card_numbers', '').split(',') if card.strip()))
+    if not card_numbers:
+      raise BadRequest('card_numbers is required')
+    if len(card_numbers) > WALLET_SUMMARY_MAX_USERS:
+      raise BadRequest(f'At most {WALLET_SUMMARY_MAX_USERS} card_numbers per request')
+
+    summaries = wallet_summaries(card_numbers)
+    order = {card: index for index, card in enumerate(card_numbers)}
+    summaries.sort(key=lambda summary: order[summary['card_number']])
+    return jsonify({'wallet_fields': WALLET_SUMMARY_FIELDS, 'users': summaries}), 200
+  except BadRequest as e:
+    return jsonify({'error': str(e)}), 400
+  except Exception as e:
+    print(f"Unexpected error: {str(e)}")
+    return jsonify({'error': 'An unexpected error occurred'}), 500
+
+
 @user_route.route('/update_user', strict_slashes=False, methods=['PUT'])
+@validate_body
+@idempotent
 def update_user():
   """
   Update user details
@@ -410,6 +801,11 @@ def update_user():
   summary: Update user details
   description: Update user details in the system
   parameters:
+    - in: header
+      name: Idempotency-Key
+      required: false
+      type: string
+      description: Unique key per logical request; retries with the same key replay the first response
     - in: body
       name: user
       description: The user details to be updated
@@ -492,61 +888,75 @@ def update_user():
       raise BadRequest('No id provided')
 
     id = data.get('id')
+    loader = user_loader()
 
-    # Try to find user in MongoDB first
-    mongo_user = user_collection.find_one({
-    '$or': [
-      {'id': id},
-      {'card_number': id},
-    ]
-    })
+    # The user's shard, and the one a new card number moves them to
+    shard = shard_of_user(id)
+    target = shard_for(data['card_number']) if 'card_number' in data else shard
+    with use_shard(shard):
+      # Both candidate keys, and the card_number being claimed, in one query
+      if 'card_number' in data:
+        loader.queue_sql(('card_number', data['card_number']))
+      user = loader.sql(('id', id), ('card_number', id))
+      if not user:
+        return jsonify({'error': 'user not found'}), 404
 
-    if mongo_user:
-      field_map = {
-        'fullName': 'fullName',
-        'card_number': 'card_number',
-        'phone': 'phone_number'
-      }
+      # Checked before either store is written
+      if 'card_number' in data:
+        holder = loader.sql(('card_number', data['card_number']))
+        if holder is None and target != shard:
+          with use_shard(target):
+            holder = User.query.filter(User.card_number == data['card_number']).first()
+        if holder is not None and holder.id != user.id:
+          raise BadRequest('card_number is already in use')
 
-    user_id = mongo_user.get('_id')
-    for key, value in field_map.items():
-      if key in data:
-        user_collection.update_one(
-          {'_id': user_id},
-          {'$set': {value: data[key]}}
-        )
-
-    # Also check SQL database
-    user = User.query.filter(
-      (User.id == id) |
-      (User.card_number == id)
-      ).first()
-    
-    if not user:
-      return jsonify({'error': 'user not found'}), 404
-    user_id = user.id
-    
-    # Get the specific user type instance
-    user = User.query.get(user_id)
-    if not user:
-      return jsonify({'error': 'user not found'}), 404
+      mongo_user = loader.mongo(('id', id), ('card_number', id))
+      user_id = user.id
+      db.session.rollback()
+
+    # Move the rows before the new card number is committed: after a failed
+    # move the card number, and so the shard it maps to, is unchanged. If
+    # the update then fails the user is moved back; should that fail too,
+    # shard_of_user still finds them and the rebalance command moves them.
+    if target != shard:
+      try:
+        move_users(shard, target, [user_id])
+      except Exception as e:
+        db.session.rollback()
+        print(f"Moving user {user_id} to {target} failed: {str(e)}")
+        return jsonify({'error': 'The user could not be moved for the new card number; try again'}), 500
 
-    if 'card_number' in data and User.query.filter(User.card_number == data['card_number'], User.id != user.id).first():
-      raise BadRequest('card_number is already in use')
-    
     # Update user details in SQL database
-    for key in ['fullName', 'card_number', 'phone']:
-      if key in data:
-        setattr(user, key, data[key])
+    with use_shard(target):
+      try:
+        user = User.query.get(user_id)
+        # The model's setters keep name_normalized and phone_normalized
+        # in step; MongoDB gets the values SQL committed
+        changes = {}
+        for key, (attribute, field) in USER_UPDATE_FIELDS.items():
+          if key in data:
+            setattr(user, attribute, data[key])
+            changes[field] = getattr(user, attribute)
+        db.session.commit()
+      except Exception:
+        db.session.rollback()
+        if target != shard:
+          move_users(target, shard, [user_id])
+        raise
 
-    db.session.commit()
+    # MongoDB follows once SQL, the source of truth, has the change
+    if mongo_user and changes:
+      changes[CHECKSUM_FIELD] = mirror_checksum({**mongo_user, **changes})
+      user_collection.update_one({'_id': mongo_user['_id']}, {'$set': changes})
 
     return jsonify({'message': 'user updated successfully'}), 200
 
   except BadRequest as e:
     return jsonify({'error': str(e)}), 400
-  except IntegrityError:
+  except IntegrityError as e:
     db.session.rollback()
+    if not is_unique_violation(e):
+      return jsonify({'error': 'Error updating user due to invalid data'}), 400
     return jsonify({'error': 'Error updating user due to integrity constraint', 'code': 'usr409'}), 409
   except Exception as e:
     db.session.rollback()
@@ -628,34 +1038,26 @@ def delete_user(card_number):
     if not card_number:
       raise BadRequest('No Id provided')
 
-    # Try to find user in MongoDB first
-    mongo_user = user_collection.find_one({'card_number': card_number})
-    user_id = None
-    if mongo_user:
-      user_id = mongo_user.get('id')
-    if not user_id:
-      # If not found in MongoDB, check SQL database
-      user = User.query.filter((User.card_number == card_number)).first()
-    if not user:
-      return jsonify({'error': 'user not found'}), 404
-    user_id = user.id
-
-    # Get the specific user type instance
-    user = User.query.get(user_id)
-    if not user:
-      return jsonify({'error': 'user not found'}), 404
+    with use_shard(shard_for(card_number)):
+      loader = user_loader()
+      mongo_user = loader.mongo(('card_number', card_number))
 
-    # Prepare user data for archiving
-    user_dict = {k: v for k, v in user.__dict__.items() if not k.startswith('_')}
-    user_dict['deleted_at'] = datetime.utcnow()
+      # Prefer the id MongoDB links to, else the card number; one query either way
+      user = loader.sql(('id', mongo_user.get('id') if mongo_user else None),
+                        ('card_number', card_number))
+      if not user:
+        return jsonify({'error': 'user not found'}), 404
 
-    # Delete from MongoDB and archive
-    user_collection.delete_one({'card_number': user.card_number})
-    deleted_user_collection.insert_one(user_dict)
+      # Archive the user and their wallets, then delete from MongoDB
+      wallets = user.owned_wallets
+      archive_user(user, mongo_user, wallets=wallets)
+      user_collection.delete_one({'card_number': user.card_number})
 
-    # Delete from SQL database
-    db.session.delete(user)
-    db.session.commit()
+      # Delete from SQL database
+      for wallet in wallets:
+        db.session.delete(wallet)
+      db.session.delete(user)
+      db.session.commit()
 
     return jsonify({'message': 'user deleted successfully'}), 200
 
@@ -668,3 +1070,222 @@ def delete_user(card_number):
     db.session.rollback()
     print(f"Unexpected error: {str(e)}")
     return jsonify({'error': 'An unexpected error occurred'}), 500
+
+
+@user_route.route('/deleted/<string:card_number>', strict_slashes=False, methods=['GET'])
+@admin_required
+def get_deleted_user(card_number):
+  """
+  Archived records of a deleted user
+  ---
+  tags:
+    - User
+  summary: Look up a deleted user
+  description: >
+    Every archived deletion of the card number, most recent first, with
+    the MySQL row and MongoDB document as they were when deleted.
+    Requires the X-Admin-Key header.
+  parameters:
+    - in: header
+      name: X-Admin-Key
+      required: true
+      type: string
+    - in: path
+      name: card_number
+      required: true
+      type: string
+      description: The card number of the deleted user
+  responses:
+    200:
+      description: Archived records
+      schema:
+        type: object
+        properties:
+          records:
+            type: array
+            items:
+              type: object
+              properties:
+                card_number:
+                  type: string
+                user_id:
+                  type: string
+                deleted_at:
+                  type: string
+                user:
+                  type: object
+                mongo:
+                  type: object
+    403:
+      description: Missing or wrong admin key
+    404:
+      description: No archived record for the card number
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+    500:
+      description: Unexpected internal server error
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+  """
+  try:
+    records = archived_users(card_number)
+    if not records:
+      return jsonify({'error': 'user not found'}), 404
+    for record in records:
+      record['deleted_at'] = record['deleted_at'].isoformat()
+    return jsonify({'records': records}), 200
+  except Exception as e:
+    print(f"Unexpected error: {str(e)}")
+    return jsonify({'error': 'An unexpected error occurred'}), 500
+
+
+@user_route.route('/search', strict_slashes=False, methods=['GET'])
+def search_users():
+  """
+  Search users by name or phone number prefix
+  ---
+  tags:
+    - User
+  summary: Search users
+  description: >
+    Case-insensitive prefix search over full name, or over the digits of
+    the phone number when the query is numeric. Results are ordered by the
+    matched value and paged with an opaque cursor.
+  parameters:
+    - in: query
+      name: q
+      required: true
+      type: string
+      description: Name or phone number prefix (at least 2 characters)
+    - in: query
+      name: limit
+      required: false
+      type: integer
+      description: Page size (default 20, max 100)
+    - in: query
+      name: cursor
+      required: false
+      type: string
+      description: next_cursor from the previous page
+  responses:
+    200:
+      description: Matching users
+      schema:
+        type: object
+        properties:
+          users:
+            type: array
+            items:
+              type: object
+              properties:
+                id:
+                  type: string
+                fullName:
+                  type: string
+                card_number:
+                  type: string
+                phone_number:
+                  type: string
+                account_type:
+                  type: string
+          next_cursor:
+            type: string
+            description: Cursor for the next page, null on the last page
+      examples:
+        application/json:
+          {
+            "users": [
+              {
+                "id": "12345",
+                "fullName": "John Doe",
+                "card_number": "1234-5678-9012-3456",
+                "phone_number": "123-456-7890",
+                "account_type": "standard"
+              }
+            ],
+            "next_cursor": null
+          }
+    400:
+      description: Bad request due to missing or invalid input
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+    500:
+      description: Unexpected internal server error
+      schema:
+        type: object
+        properties:
+          error:
+            type: string
+            description: Error message
+  """
+  try:
+    term = (request.args.get('q') or '').strip()
+    if len(term) < SEARCH_MIN_LENGTH:
+      raise BadRequest(f'q must be at least {SEARCH_MIN_LENGTH} characters')
+
+    try:
+      limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+      raise BadRequest('limit must be an integer')
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+
+    # Numeric queries search the digits-only phone column, anything else the
+    # case-folded name. Both sort by code point, as the shard merge compares.
+    digits = normalize_phone(term)
+    if digits and not any(char.isalpha() for char in term):
+      column, prefix = User.phone_normalized, digits
+    else:
+      column, prefix = User.name_normalized, normalize_name(term)
+
+    query = User.query.with_entities(
+      column, User.id, User.full_name, User.card_number,
+      User.phone_number, User.account_type,
+    ).filter(column.startswith(prefix, autoescape=True))
+
+    cursor = request.args.get('cursor')
+    if cursor:
+      last_value, last_id = decode_cursor(cursor, 2)
+      query = query.filter(
+        column >= last_value,
+        (column > last_value) | (User.id > last_id)
+      )
+
+    # Each shard returns its own first limit + 1 matches; merged, the first
+    # limit + 1 of those are the first overall
+    query = query.order_by(column, User.id).limit(limit + 1)
+    rows = list(islice(
+      scatter_gather(lambda: query, key=lambda row: (row[0], row[1])), limit + 1))
+    next_cursor = None
+    if len(rows) > limit:
+      rows = rows[:limit]
+      next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+
+    users = [
+      {
+        'id': row[1],
+        'fullName': row[2],
+        'card_number': row[3],
+        'phone_number': row[4],
+        'account_type': row[5],
+      }
+      for row in rows
+    ]
+
+    return jsonify({'users': users, 'next_cursor': next_cursor}), 200
+  except BadRequest as e:
+    return jsonify({'error': str(e)}), 400
+  except Exception as e:
+    print(f"Unexpected error: {str(e)}")
+    return jsonify({'error': 'An unexpected error occurred'}), 500
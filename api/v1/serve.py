@@ -0,0 +1,198 @@
+"""
+Production server: gunicorn with a selectable worker model
+
+    python -m api.v1.serve [--worker-class sync|gthread|gevent] [--bind ...]
+
+Every option also reads a SERVE_* environment variable. Worker, thread and
+connection counts default to values sized from the CPU count and the SQL
+pool limits; --print-config shows what would be used.
+"""
+from gunicorn.app.base import BaseApplication
+from sqlalchemy.engine import make_url
+from os import environ
+import argparse
+import gc
+import json
+import os
+import sys
+
+from .config import config, DB_MAX_CONNECTIONS
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+# Drivers that block the whole process under gevent
+GEVENT_UNSAFE_DRIVERS = ('mysqldb',)
+
+
+def cpu_count():
+    """
+    CPUs this process may run on, which can be fewer than the machine has
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def size_workers(worker_class, cores, pool_capacity, max_connections,
+                 engines=1):
+    """
+    (workers, threads, worker_connections) for a worker model.
+    A request holds at most one pooled SQL connection, so concurrency per
+    worker is set from the pool, and the worker count is capped so every
+    worker's pools filling up still stays within max_connections. Each
+    engine (the primary, every replica and shard bind) has its own pool.
+    """
+    if worker_class == 'sync':
+        workers, threads, connections = 2 * cores + 1, 1, 1
+        worker_connections = 1
+    elif worker_class == 'gthread':
+        workers, threads = cores + 1, pool_capacity
+        connections = worker_connections = threads
+    else:
+        # Greenlets beyond the pool wait for a connection while others are
+        # busy in MongoDB, bcrypt or mail
+        workers, threads, connections = cores, 1, pool_capacity
+        worker_connections = 4 * pool_capacity
+    workers = max(1, min(workers, max_connections // (connections * engines)))
+    return workers, threads, worker_connections
+
+
+def check_gevent_drivers(app_config):
+    """
+    Refuse to start gevent workers on a SQL driver that cannot be patched
+    """
+    urls = [app_config.SQLALCHEMY_DATABASE_URI,
+            *app_config.SQLALCHEMY_BINDS.values()]
+    for url in urls:
+        driver = make_url(url).get_driver_name()
+        if driver in GEVENT_UNSAFE_DRIVERS:
+            sys.exit(f'The {driver} driver blocks gevent workers; '
+                     f'use DB_TYPE=mysql+pymysql')
+
+
+def gevent_patched():
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('socket')
+
+
+def post_fork(server, worker):
+    app = server.app.callable
+    if app is None:
+        # Not preloaded, so the master has opened no connections
+        return
+    # Connections opened in the master (create_all) must not be shared
+    from .database.mysql import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    from .views.write_behind import login_stamps
+    from .views.tracing import tracer
+    login_stamps.flush()
+    tracer.exporter.flush()
+
+
+class ServeApplication(BaseApplication):
+    """
+    Gunicorn application configured from a dict instead of a config file
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from .app import app
+        if self.cfg.preload_app:
+            # Keep the collector away from everything loaded so far, so
+            # collections in the workers don't touch (and copy) shared pages.
+            # Workers inherit the frozen state; the master collects again.
+            gc.freeze()
+            gc.enable()
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m api.v1.serve')
+    parser.add_argument('--worker-class', choices=WORKER_CLASSES,
+                        default=environ.get('SERVE_WORKER_CLASS', 'gthread'))
+    parser.add_argument('--bind', default=environ.get(
+        'SERVE_BIND', f"0.0.0.0:{environ.get('PORT', '5000')}"))
+    parser.add_argument('--workers', type=int,
+                        default=environ.get('SERVE_WORKERS'))
+    parser.add_argument('--threads', type=int,
+                        default=environ.get('SERVE_THREADS'))
+    parser.add_argument('--worker-connections', type=int,
+                        default=environ.get('SERVE_WORKER_CONNECTIONS'))
+    parser.add_argument('--max-requests', type=int,
+                        default=environ.get('SERVE_MAX_REQUESTS', '2000'))
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=environ.get('SERVE_MAX_REQUESTS_JITTER'),
+                        help='Defaults to a tenth of --max-requests')
+    parser.add_argument('--timeout', type=int,
+                        default=environ.get('SERVE_TIMEOUT', '30'))
+    parser.add_argument('--graceful-timeout', type=int,
+                        default=environ.get('SERVE_GRACEFUL_TIMEOUT', '30'))
+    parser.add_argument('--no-preload', action='store_true',
+                        default=environ.get('SERVE_PRELOAD', '1') == '0')
+    parser.add_argument('--print-config', action='store_true',
+                        help='Print the resolved settings and exit')
+    return parser.parse_args(argv)
+
+
+def build_settings(options):
+    app_config = config[environ.get('FLASK_ENV', 'production')]
+    pool = app_config.SQLALCHEMY_ENGINE_OPTIONS
+    workers, threads, worker_connections = size_workers(
+        options.worker_class, cpu_count(),
+        pool['pool_size'] + pool['max_overflow'], DB_MAX_CONNECTIONS,
+        engines=1 + len(app_config.SQLALCHEMY_BINDS))
+    return {
+        'bind': options.bind,
+        'worker_class': options.worker_class,
+        'workers': options.workers or workers,
+        'threads': options.threads or threads,
+        'worker_connections': options.worker_connections or worker_connections,
+        'preload_app': not options.no_preload,
+        'max_requests': options.max_requests,
+        'max_requests_jitter': options.max_requests_jitter
+        if options.max_requests_jitter is not None
+        else options.max_requests // 10,
+        'timeout': options.timeout,
+        'graceful_timeout': options.graceful_timeout,
+        'keepalive': 5,
+        'accesslog': '-',
+    }
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    settings = build_settings(options)
+    if options.print_config:
+        print(json.dumps(settings, indent=2))
+        return
+
+    if options.worker_class == 'gevent':
+        check_gevent_drivers(config[environ.get('FLASK_ENV', 'production')])
+        if not gevent_patched():
+            # The patch has to run before the package imports anything, which
+            # happens in api/v1/patching.py once this variable is set
+            os.execve(sys.executable,
+                      [sys.executable, '-m', 'api.v1.serve', *sys.argv[1:]],
+                      dict(environ, SERVE_WORKER_CLASS='gevent'))
+
+    if settings['preload_app']:
+        # Nothing allocated while loading is collected before gc.freeze()
+        gc.disable()
+    ServeApplication(dict(settings, post_fork=post_fork,
+                          worker_exit=worker_exit)).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+from flask import current_app, jsonify, request
+from functools import wraps
+import hmac
+
+
+def admin_required(view):
+    """
+    Restrict a view to callers presenting ADMIN_API_KEY in X-Admin-Key.
+    With no key configured every admin endpoint is closed.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = current_app.config.get('ADMIN_API_KEY')
+        supplied = request.headers.get('X-Admin-Key', '')
+        if not expected or not hmac.compare_digest(supplied.encode('utf-8'),
+                                                   expected.encode('utf-8')):
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
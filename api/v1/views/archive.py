@@ -0,0 +1,132 @@
+from flask import current_app
+from bson.binary import Binary
+from datetime import datetime, timedelta
+import json
+import zlib
+
+from ..models import deleted_user_archive_collection, deleted_user_collection
+from .util import to_dict
+
+_indexes_ready = False
+
+
+def _ensure_indexes():
+    """
+    Expire whole buckets after the retention period, find the open bucket
+    of a month, and find a card number's records for restores
+    """
+    global _indexes_ready
+    if not _indexes_ready:
+        deleted_user_archive_collection.create_index('expires_at',
+                                                     expireAfterSeconds=0)
+        deleted_user_archive_collection.create_index([('month', 1),
+                                                      ('count', 1)])
+        deleted_user_archive_collection.create_index(
+            [('records.card_number', 1), ('records.deleted_at', -1)])
+        _indexes_ready = True
+
+
+def _month(moment):
+    return moment.strftime('%Y-%m')
+
+
+def _expires_at(month):
+    """
+    Retention runs from the end of the bucket's month
+    """
+    start = datetime.strptime(month, '%Y-%m')
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month + timedelta(
+        days=current_app.config['ARCHIVE_RETENTION_DAYS'])
+
+
+def _record(card_number, user_id, deleted_at, data):
+    payload = json.dumps(data, default=str, separators=(',', ':'))
+    return {
+        'card_number': card_number,
+        'user_id': user_id,
+        'deleted_at': deleted_at,
+        'payload': Binary(zlib.compress(payload.encode('utf-8'))),
+    }
+
+
+def _append(month, records):
+    """
+    Push records into the month's open bucket, opening a new one when the
+    current bucket cannot take them all
+    """
+    _ensure_indexes()
+    capacity = current_app.config['ARCHIVE_BUCKET_SIZE']
+    deleted_user_archive_collection.update_one(
+        {'month': month, 'count': {'$lte': capacity - len(records)}},
+        {
+            '$push': {'records': {'$each': records}},
+            '$inc': {'count': len(records)},
+            '$setOnInsert': {'expires_at': _expires_at(month)},
+        },
+        upsert=True
+    )
+
+
+def archive_user(user, mongo_user=None, deleted_at=None, wallets=()):
+    """
+    Archive a user's MySQL row, wallets, and MongoDB document if any,
+    before they are deleted
+    """
+    deleted_at = deleted_at or datetime.utcnow()
+    data = {'user': to_dict(user)}
+    if wallets:
+        data['wallets'] = [to_dict(wallet) for wallet in wallets]
+    if mongo_user:
+        data['mongo'] = {k: v for k, v in mongo_user.items() if k != '_id'}
+    _append(_month(deleted_at),
+            [_record(user.card_number, user.id, deleted_at, data)])
+
+
+def archived_users(card_number):
+    """
+    Archived records for a card number, most recently deleted first
+    """
+    _ensure_indexes()
+    records = deleted_user_archive_collection.aggregate([
+        {'$match': {'records.card_number': card_number}},
+        {'$unwind': '$records'},
+        {'$match': {'records.card_number': card_number}},
+        {'$sort': {'records.deleted_at': -1}},
+        {'$replaceRoot': {'newRoot': '$records'}},
+    ])
+    return [
+        {
+            'card_number': record['card_number'],
+            'user_id': record['user_id'],
+            'deleted_at': record['deleted_at'],
+            **json.loads(zlib.decompress(record['payload'])),
+        }
+        for record in records
+    ]
+
+
+def archive_legacy(batch_size=500):
+    """
+    Move documents from the old one-per-user deleted_user collection into
+    monthly buckets. Returns the number moved.
+    """
+    batch_size = min(batch_size, current_app.config['ARCHIVE_BUCKET_SIZE'])
+    moved = 0
+    while True:
+        docs = list(deleted_user_collection.find().limit(batch_size))
+        if not docs:
+            return moved
+        by_month = {}
+        for doc in docs:
+            deleted_at = doc.get('deleted_at') or doc['_id'].generation_time \
+                .replace(tzinfo=None)
+            data = {'user': {k: v for k, v in doc.items()
+                             if k not in ('_id', 'deleted_at')}}
+            by_month.setdefault(_month(deleted_at), []).append(_record(
+                doc.get('card_number'), doc.get('id'), deleted_at, data))
+        for month, records in by_month.items():
+            _append(month, records)
+        deleted_user_collection.delete_many(
+            {'_id': {'$in': [doc['_id'] for doc in docs]}})
+        moved += len(docs)
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+from sqlalchemy import text
+import os
+import threading
+import time
+
+from ..models import db, mongod_client
+
+
+def pool_stats(engine):
+    """
+    Connection pool utilisation of one engine; no I/O
+    """
+    pool = engine.pool
+    stats = {'class': type(pool).__name__}
+    if not hasattr(pool, 'checkedout'):
+        return stats
+    size = pool.size()
+    max_overflow = max(getattr(pool, '_max_overflow', 0), 0)
+    checked_out = pool.checkedout()
+    stats.update({
+        'size': size,
+        'max_overflow': max_overflow,
+        'checked_out': checked_out,
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'utilisation': round(checked_out / (size + max_overflow), 3)
+        if size + max_overflow else 0.0,
+    })
+    return stats
+
+
+def _ping_sql(engine):
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+
+
+def _ping_mongo(client):
+    client.admin.command('ping')
+
+
+def _timed(probe, target):
+    started = time.perf_counter()
+    probe(target)
+    return time.perf_counter() - started
+
+
+class ReadinessCheck:
+    """
+    Pings every SQL engine and MongoDB, each bounded by
+    HEALTH_PROBE_TIMEOUT_SECONDS. The result is cached for
+    HEALTH_CACHE_SECONDS and only one request per worker refreshes it, so
+    load balancer probes never stampede the databases. A probe that is
+    still hung from an earlier check counts as failed rather than being
+    started again.
+    """
+    def __init__(self):
+        self.cache_seconds = 2.0
+        self.timeout = 1.0
+        self._result = None
+        self._checked = 0.0
+        self._running = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.cache_seconds = app.config['HEALTH_CACHE_SECONDS']
+        self.timeout = app.config['HEALTH_PROBE_TIMEOUT_SECONDS']
+
+    def check(self):
+        """
+        (result, cached) where result maps each dependency to its probe
+        """
+        with self._lock:
+            if self._result is not None and \
+                    time.monotonic() - self._checked < self.cache_seconds:
+                return self._result, True
+            probes = {'mongodb': (_ping_mongo, mongod_client)}
+            for key, engine in db.engines.items():
+                name = 'mysql' if key is None else f'mysql_{key}'
+                probes[name] = (_ping_sql, engine)
+            self._result = self._run(probes)
+            self._checked = time.monotonic()
+            return self._result, False
+
+    def _run(self, probes):
+        # Probe threads do not survive a fork, so key the executor by pid
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(probes), thread_name_prefix='health-probe')
+            self._running = {}
+            self._pid = os.getpid()
+
+        started = {}
+        for name, (probe, target) in probes.items():
+            running = self._running.get(name)
+            if running is not None and not running.done():
+                continue
+            started[name] = time.perf_counter()
+            self._running[name] = self._executor.submit(_timed, probe, target)
+
+        deadline = time.perf_counter() + self.timeout
+        results = {}
+        for name in probes:
+            if name not in started:
+                results[name] = {'ok': False,
+                                 'error': 'Previous probe has not returned'}
+                continue
+            try:
+                elapsed = self._running[name].result(
+                    timeout=max(deadline - time.perf_counter(), 0))
+                results[name] = {'ok': True}
+            except TimeoutError:
+                elapsed = time.perf_counter() - started[name]
+                results[name] = {'ok': False, 'error': 'Probe timed out'}
+            except Exception as e:
+                elapsed = time.perf_counter() - started[name]
+                results[name] = {'ok': False, 'error': str(e)}
+            results[name]['latency_ms'] = round(elapsed * 1000, 2)
+        return {
+            'ready': all(result['ok'] for result in results.values()),
+            'checked_at': datetime.utcnow().isoformat(),
+            'checks': results,
+        }
+
+
+readiness = ReadinessCheck()
@@ -0,0 +1,150 @@
+from flask import current_app, jsonify, make_response, request, Response
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+import time
+import uuid
+
+from ..models import idempotency_collection
+
+MAX_KEY_LENGTH = 255
+_indexes_ready = False
+
+
+def _ensure_indexes():
+    """
+    Let MongoDB expire stored responses on its own
+    """
+    global _indexes_ready
+    if not _indexes_ready:
+        idempotency_collection.create_index('expires_at', expireAfterSeconds=0)
+        _indexes_ready = True
+
+
+def _caller():
+    """
+    Whose keys these are: the JWT identity, or the client address for
+    anonymous requests, so two callers never share a stored response
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    if identity is not None:
+        return f'id:{identity}'
+    return f'ip:{request.remote_addr}'
+
+
+def _claim(store_key, fingerprint, owner):
+    """
+    Try to become the request that executes for store_key, holding the
+    lease as owner. Returns None on success, otherwise the stored record.
+    """
+    while True:
+        now = datetime.utcnow()
+        lock_until = now + timedelta(
+            seconds=current_app.config['IDEMPOTENCY_LOCK_SECONDS'])
+        try:
+            idempotency_collection.insert_one({
+                '_id': store_key,
+                'state': 'pending',
+                'fingerprint': fingerprint,
+                'owner': owner,
+                'locked_until': lock_until,
+                'expires_at': now + current_app.config['IDEMPOTENCY_KEY_TTL'],
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        # Take over a pending record whose owner died without finishing
+        result = idempotency_collection.update_one(
+            {'_id': store_key, 'state': 'pending', 'fingerprint': fingerprint,
+             'locked_until': {'$lt': now}},
+            {'$set': {'locked_until': lock_until, 'owner': owner}}
+        )
+        if result.modified_count:
+            return None
+        record = idempotency_collection.find_one({'_id': store_key})
+        if record is not None:
+            return record
+        # Released or expired since the insert failed; try to claim it again
+
+
+def _replay(record):
+    response = Response(record['body'], status=record['status'],
+                        content_type=record['content_type'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a write endpoint.
+    The first request with a key runs normally and its response is stored
+    with a TTL; concurrent duplicates wait for it to finish, and later
+    retries are answered from the store without running the view.
+    Keys belong to the caller: the JWT identity, else the client address.
+    Requests without the header are passed straight through.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+
+        _ensure_indexes()
+        store_key = f'{_caller()}:{request.method}:{request.path}:{key}'
+        owner = uuid.uuid4().hex
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.monotonic() + current_app.config['IDEMPOTENCY_WAIT_SECONDS']
+        delay = 0.05
+
+        while True:
+            record = _claim(store_key, fingerprint, owner)
+            if record is None:
+                break
+            if record['fingerprint'] != fingerprint:
+                return jsonify({
+                    'error': 'Idempotency-Key was already used with a different payload',
+                    'code': 'idem422'
+                }), 422
+            if record['state'] == 'done':
+                return _replay(record)
+            if time.monotonic() >= deadline:
+                return jsonify({
+                    'error': 'A request with this Idempotency-Key is still in progress',
+                    'code': 'idem409'
+                }), 409
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        # Only while the lease is still ours: a request that overran it and
+        # was taken over must not touch the new owner's record
+        ours = {'_id': store_key, 'state': 'pending', 'owner': owner}
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_collection.delete_one(ours)
+            raise
+
+        if response.status_code >= 500:
+            # Server errors are not final; let the client retry for real
+            idempotency_collection.delete_one(ours)
+        else:
+            idempotency_collection.update_one(
+                ours,
+                {'$set': {
+                    'state': 'done',
+                    'status': response.status_code,
+                    'body': response.get_data(),
+                    'content_type': response.content_type,
+                }}
+            )
+        return response
+    return wrapper
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from flask_jwt_extended import JWTManager
+import hashlib
+import threading
+import time
+
+
+class DecodeCache:
+    """
+    Bounded LRU of token digest -> verified claims. Entries are dropped
+    once the token's exp has passed.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires = entry
+                if expires is None or time.time() < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return claims
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, claims, expires):
+        with self._lock:
+            self._entries[key] = (claims, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachingJWTManager(JWTManager):
+    """
+    JWTManager that skips signature verification and claim parsing for
+    tokens it has already verified. Revocation is still checked on every
+    request because the blocklist callback runs after decoding.
+    """
+    def __init__(self, app=None, add_context_processor=False):
+        self.decode_cache = DecodeCache()
+        super().__init__(app, add_context_processor)
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+        self.decode_cache.maxsize = app.config['JWT_DECODE_CACHE_SIZE']
+        self.decode_cache.clear()
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None,
+                                allow_expired=False):
+        if allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value,
+                                                   allow_expired)
+
+        # The CSRF value is part of what gets verified, so it is part of the key
+        key = hashlib.sha256(
+            f'{encoded_token}\0{csrf_value or ""}'.encode('utf-8')).digest()
+        claims = self.decode_cache.get(key)
+        if claims is None:
+            claims = super()._decode_jwt_from_config(encoded_token, csrf_value)
+            self.decode_cache.put(key, claims, claims.get('exp'))
+        # Callers may modify the claims they get back
+        return dict(claims)
@@ -0,0 +1,104 @@
+from flask import g
+from sqlalchemy import or_
+
+from ..models import user_collection
+from ..models.user import User
+from ..database.mongodb import for_reads
+
+SQL_KEYS = {
+    'id': User.id,
+    'card_number': User.card_number,
+}
+MONGO_KEYS = ('id', 'card_number', 'email')
+
+
+class UserLoader:
+    """
+    Request-scoped, DataLoader-style cache of user lookups in MySQL and
+    MongoDB. Keys are (field, value) pairs. Every key queued before a
+    lookup is resolved in the same IN / $in query, each record is indexed
+    under all of its key fields, and misses are remembered, so a user is
+    fetched at most once per store per request.
+    """
+    def __init__(self):
+        self._cache = {'sql': {}, 'mongo': {}}
+        self._queued = {'sql': set(), 'mongo': set()}
+
+    def queue_sql(self, *keys):
+        self._queue('sql', keys, SQL_KEYS)
+
+    def queue_mongo(self, *keys):
+        self._queue('mongo', keys, MONGO_KEYS)
+
+    def sql(self, *keys):
+        """
+        The first User found under keys, or None
+        """
+        self.queue_sql(*keys)
+        self._resolve('sql', self._fetch_sql, SQL_KEYS)
+        return self._first('sql', keys)
+
+    def mongo(self, *keys):
+        """
+        The first user document found under keys, or None
+        """
+        self.queue_mongo(*keys)
+        self._resolve('mongo', self._fetch_mongo, MONGO_KEYS)
+        return self._first('mongo', keys)
+
+    def clear(self):
+        """
+        Forget everything, e.g. after the request changed a key field
+        """
+        self._cache = {'sql': {}, 'mongo': {}}
+
+    def _queue(self, store, keys, fields):
+        for field, value in keys:
+            if field not in fields:
+                raise ValueError(f'Users cannot be loaded by {field}')
+            if value is not None and (field, value) not in self._cache[store]:
+                self._queued[store].add((field, value))
+
+    def _first(self, store, keys):
+        for key in keys:
+            record = self._cache[store].get(key)
+            if record is not None:
+                return record
+        return None
+
+    def _resolve(self, store, fetch, fields):
+        queued, self._queued[store] = self._queued[store], set()
+        if not queued:
+            return
+        by_field = {}
+        for field, value in queued:
+            by_field.setdefault(field, []).append(value)
+
+        cache = self._cache[store]
+        for field, value in queued:
+            cache[(field, value)] = None
+        for record in fetch(by_field):
+            for field in fields:
+                value = record.get(field) if store == 'mongo' \
+                    else getattr(record, field)
+                if value is not None:
+                    cache[(field, value)] = record
+
+    def _fetch_sql(self, by_field):
+        return User.query.filter(or_(*[
+            SQL_KEYS[field].in_(values) for field, values in by_field.items()
+        ])).all()
+
+    def _fetch_mongo(self, by_field):
+        return for_reads(user_collection).find({'$or': [
+            {field: {'$in': values}} for field, values in by_field.items()
+        ]})
+
+
+def user_loader():
+    """
+    The current request's UserLoader
+    """
+    if 'user_loader' not in g:
+        g.user_loader = UserLoader()
+    return g.user_loader
@@ -0,0 +1,240 @@
+from flask import request
+from datetime import datetime
+from werkzeug.exceptions import BadRequest
+import gc
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+GROUP_BY = ('lineno', 'filename', 'traceback')
+MAX_FRAMES = 25
+
+# Allocations made by tracemalloc itself and the import machinery are noise
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes, or None where /proc is not
+    available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def gc_stats():
+    return {
+        'counts': list(gc.get_count()),
+        'thresholds': list(gc.get_threshold()),
+        'collections': [generation['collections'] for generation in gc.get_stats()],
+        'collected': [generation['collected'] for generation in gc.get_stats()],
+        'uncollectable': len(gc.garbage),
+        'frozen': gc.get_freeze_count(),
+    }
+
+
+def _site(traceback):
+    frame = traceback[0]
+    return f'{frame.filename}:{frame.lineno}'
+
+
+def _statistic(stat, group_by):
+    entry = {'site': _site(stat.traceback), 'size_bytes': stat.size,
+             'count': stat.count}
+    if group_by == 'traceback':
+        entry['traceback'] = stat.traceback.format()
+    return entry
+
+
+def _difference(stat, group_by):
+    entry = _statistic(stat, group_by)
+    entry.update({'size_diff_bytes': stat.size_diff,
+                  'count_diff': stat.count_diff})
+    return entry
+
+
+class MemoryProfiler:
+    """
+    Starts and stops tracemalloc in this worker and reports the top
+    allocation sites, plus the difference from the snapshot taken at start
+    or from the previous snapshot. Tracing slows every allocation, so it
+    is only on between start() and stop().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline = None
+        self._previous = None
+        self._started_at = None
+
+    def status(self):
+        tracing = tracemalloc.is_tracing()
+        traced, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            'pid': os.getpid(),
+            'tracing': tracing,
+            'frames': tracemalloc.get_traceback_limit() if tracing else None,
+            'started_at': self._started_at,
+            'traced_bytes': traced,
+            'peak_bytes': peak,
+            'overhead_bytes': tracemalloc.get_tracemalloc_memory(),
+        }
+
+    def start(self, frames=1):
+        if not 1 <= frames <= MAX_FRAMES:
+            raise BadRequest(f'frames must be between 1 and {MAX_FRAMES}')
+        with self._lock:
+            if tracemalloc.is_tracing():
+                raise BadRequest('tracemalloc is already running in this worker')
+            tracemalloc.start(frames)
+            self._started_at = datetime.utcnow().isoformat()
+            self._baseline = self._previous = self._take()
+        return self.status()
+
+    def stop(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise BadRequest('tracemalloc is not running in this worker')
+            tracemalloc.stop()
+            self._baseline = self._previous = self._started_at = None
+        return self.status()
+
+    def snapshot(self, limit=20, group_by='lineno', compare_to='previous'):
+        """
+        The limit largest allocation sites and the limit largest changes
+        since compare_to: 'start' or the 'previous' snapshot
+        """
+        if group_by not in GROUP_BY:
+            raise BadRequest(f'group_by must be one of {", ".join(GROUP_BY)}')
+        if compare_to not in ('start', 'previous'):
+            raise BadRequest('compare_to must be start or previous')
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise BadRequest('tracemalloc is not running in this worker')
+            snapshot = self._take()
+            reference = self._baseline if compare_to == 'start' else self._previous
+            self._previous = snapshot
+        return {
+            **self.status(),
+            'group_by': group_by,
+            'compare_to': compare_to,
+            'top': [_statistic(stat, group_by)
+                    for stat in snapshot.statistics(group_by)[:limit]],
+            'diff': [_difference(stat, group_by)
+                     for stat in snapshot.compare_to(reference, group_by)[:limit]],
+        }
+
+    @staticmethod
+    def _take():
+        return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+class MemoryStats:
+    """
+    Prints one JSON line of RSS and GC statistics per worker every
+    MEMORY_STATS_INTERVAL_SECONDS (0 disables it), with the endpoints whose
+    requests grew RSS the most since the previous line. Growth is RSS
+    after a request minus before it; with threaded workers concurrent
+    requests share the blame.
+    """
+    def __init__(self):
+        self.interval = 60.0
+        self._endpoints = {}
+        self._window = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        self.interval = app.config['MEMORY_STATS_INTERVAL_SECONDS']
+        if self.interval <= 0:
+            return
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def watch(self, name, size):
+        """
+        Report size() as a gauge on every line, e.g. the length of a cache
+        """
+        self._gauges[name] = size
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(totals) for name, totals in self._endpoints.items()}
+        return {
+            'pid': os.getpid(),
+            'at': datetime.utcnow().isoformat(),
+            'rss_bytes': current_rss(),
+            'gc': gc_stats(),
+            'gauges': {name: size() for name, size in self._gauges.items()},
+            'endpoints': endpoints,
+        }
+
+    def emit(self, top=5):
+        line = self.stats()
+        del line['endpoints']
+        with self._lock:
+            window, self._window = self._window, {}
+        line['rss_growth_by_endpoint'] = dict(sorted(
+            window.items(), key=lambda item: item[1], reverse=True)[:top])
+        print(json.dumps({'memory_stats': line}), flush=True)
+
+    def _before_request(self):
+        self._ensure_started()
+        request.environ['memory_stats.rss'] = current_rss()
+
+    def _teardown_request(self, exc=None):
+        before = request.environ.get('memory_stats.rss')
+        after = current_rss()
+        if before is None or after is None:
+            return
+        growth = max(after - before, 0)
+        endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            totals = self._endpoints.setdefault(
+                endpoint, {'requests': 0, 'rss_growth_bytes': 0,
+                           'max_rss_growth_bytes': 0})
+            totals['requests'] += 1
+            totals['rss_growth_bytes'] += growth
+            totals['max_rss_growth_bytes'] = max(
+                totals['max_rss_growth_bytes'], growth)
+            if growth:
+                self._window[endpoint] = self._window.get(endpoint, 0) + growth
+
+    def _ensure_started(self):
+        # The emitter thread does not survive a fork, so key it by pid
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._endpoints, self._window = {}, {}
+            threading.Thread(target=self._emit_loop, daemon=True,
+                             name='memory-stats').start()
+
+    def _emit_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.emit()
+            except Exception as e:
+                print(f"Memory stats failed: {str(e)}")
+
+
+profiler = MemoryProfiler()
+memory_stats = MemoryStats()
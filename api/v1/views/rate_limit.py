@@ -0,0 +1,178 @@
+from flask import current_app, jsonify, request
+from functools import wraps
+from importlib import import_module
+import math
+import os
+import sqlite3
+import threading
+import time
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit):
+    """
+    Turn '10/minute' into (capacity, tokens refilled per second)
+    """
+    count, _, period = limit.partition('/')
+    count = int(count)
+    seconds = PERIODS[period.strip().rstrip('s')]
+    return count, count / seconds
+
+
+class MemoryBucketStore:
+    """
+    Token buckets held in this process only; for tests and single workers
+    """
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+
+class SQLiteBucketStore:
+    """
+    Token buckets in a SQLite file, shared by every worker on the host.
+    Each check is one short IMMEDIATE transaction on a local file.
+    """
+    PRUNE_EVERY = 1000
+    PRUNE_AFTER = 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets '
+            '(key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+        )
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=1, isolation_level=None,
+                               check_same_thread=False)
+
+    def _connection(self):
+        # Connections must not cross a fork, so key them by pid as well
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, capacity, rate, cost=1):
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT tokens, updated FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens = capacity if row is None else \
+                min(capacity, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                'INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, '
+                'updated = excluded.updated',
+                (key, tokens, now)
+            )
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                conn.execute('DELETE FROM buckets WHERE updated < ?',
+                             (now - self.PRUNE_AFTER,))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            # A limiter outage must not take authentication down with it
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Rate limiter unavailable: {str(e)}")
+            return True, 0
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+
+def load_store(uri):
+    """
+    Build a bucket store from RATELIMIT_STORAGE_URI:
+    memory://, sqlite:///path/to/file.db, or module.path:ClassName for a
+    networked backend exposing the same take() method
+    """
+    if uri.startswith('memory://'):
+        return MemoryBucketStore()
+    if uri.startswith('sqlite:///'):
+        return SQLiteBucketStore(uri[len('sqlite:///'):])
+    module, _, name = uri.partition(':')
+    return getattr(import_module(module), name)()
+
+
+class RateLimiter:
+    """
+    Per-IP and per-identity token buckets checked before a view runs
+    """
+    def __init__(self):
+        self.store = None
+
+    def init_app(self, app):
+        self.store = load_store(app.config['RATELIMIT_STORAGE_URI'])
+        app.extensions['rate_limiter'] = self
+
+    def _check(self, key, limit):
+        capacity, rate = parse_limit(limit)
+        return self.store.take(key, capacity, rate)
+
+    def limit(self, scope, identity_field=None):
+        """
+        Throttle a view using RATELIMIT_LIMITS[scope], a dict with optional
+        'ip' and 'identity' limits such as '10/minute'. The identity is
+        read from identity_field of the JSON body.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                limits = current_app.config['RATELIMIT_LIMITS'].get(scope, {})
+                if not current_app.config['RATELIMIT_ENABLED'] or not limits:
+                    return view(*args, **kwargs)
+
+                checks = []
+                if limits.get('ip'):
+                    checks.append((f'{scope}:ip:{request.remote_addr}',
+                                   limits['ip']))
+                if identity_field and limits.get('identity'):
+                    data = request.get_json(silent=True)
+                    identity = data.get(identity_field) \
+                        if isinstance(data, dict) else None
+                    if isinstance(identity, str) and identity:
+                        checks.append(
+                            (f'{scope}:id:{identity.strip().lower()}',
+                             limits['identity']))
+
+                for key, limit in checks:
+                    allowed, retry_after = self._check(key, limit)
+                    if not allowed:
+                        response = jsonify({
+                            'error': 'Too many requests, try again later',
+                            'code': 'auth429'
+                        })
+                        response.headers['Retry-After'] = \
+                            str(max(1, math.ceil(retry_after)))
+                        return response, 429
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+limiter = RateLimiter()
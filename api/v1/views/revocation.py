@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from hashlib import blake2b
+import math
+import os
+import threading
+import time
+
+from ..models import revoked_token_collection
+
+
+class BloomFilter:
+    """
+    Fixed-size set membership test with no false negatives and a bounded
+    false positive rate
+    """
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate)
+                                     / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class TokenRevocation:
+    """
+    Denylist of revoked JWT ids (jti) shared through MongoDB.
+    Each worker keeps a Bloom filter of the denylist, refreshed in the
+    background, so the common "not revoked" answer needs no I/O; only a
+    filter hit is confirmed against the store. Entries expire with the
+    token they revoke (TTL index), and periodic rebuilds drop them from
+    the filter too.
+    """
+    # Allowance for clock skew between the workers that revoke tokens
+    SKEW = timedelta(seconds=5)
+
+    def __init__(self):
+        self._filter = None
+        self._since = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, jwt):
+        self.refresh_seconds = app.config['REVOCATION_REFRESH_SECONDS']
+        self.rebuild_seconds = app.config['REVOCATION_REBUILD_SECONDS']
+        self.capacity = app.config['REVOCATION_BLOOM_CAPACITY']
+        self.error_rate = app.config['REVOCATION_BLOOM_ERROR_RATE']
+        jwt.token_in_blocklist_loader(self.is_revoked)
+
+    def revoke(self, jti, expires_at):
+        revoked_token_collection.update_one(
+            {'_id': jti},
+            {'$setOnInsert': {'expires_at': expires_at,
+                              'revoked_at': datetime.utcnow()}},
+            upsert=True
+        )
+        self._ensure_started()
+        self._filter.add(jti)
+
+    def is_revoked(self, jwt_header, jwt_payload):
+        jti = jwt_payload.get('jti')
+        if not jti:
+            return False
+        self._ensure_started()
+        if jti not in self._filter:
+            return False
+        try:
+            return revoked_token_collection.find_one({'_id': jti}, {'_id': 1}) \
+                is not None
+        except Exception as e:
+            # Fail closed: a possibly revoked token is not let through
+            print(f"Revocation lookup failed: {str(e)}")
+            return True
+
+    def _ensure_started(self):
+        # Filters and threads do not survive a fork, so key them by pid
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            revoked_token_collection.create_index('expires_at',
+                                                  expireAfterSeconds=0)
+            self._rebuild()
+            self._pid = os.getpid()
+            threading.Thread(target=self._refresh_loop, daemon=True,
+                             name='token-revocation-refresh').start()
+
+    def _rebuild(self):
+        """
+        Replace the filter with the current, unexpired denylist
+        """
+        now = datetime.utcnow()
+        jtis = [doc['_id'] for doc in revoked_token_collection.find(
+            {'expires_at': {'$gt': now}}, {'_id': 1})]
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+        self._since = now
+
+    def _refresh(self):
+        """
+        Add tokens revoked by other workers since the last refresh
+        """
+        now = datetime.utcnow()
+        for doc in revoked_token_collection.find(
+                {'revoked_at': {'$gte': self._since - self.SKEW}}, {'_id': 1}):
+            self._filter.add(doc['_id'])
+        self._since = now
+
+    def _refresh_loop(self):
+        next_rebuild = time.monotonic() + self.rebuild_seconds
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                if time.monotonic() >= next_rebuild:
+                    self._rebuild()
+                    next_rebuild = time.monotonic() + self.rebuild_seconds
+                else:
+                    self._refresh()
+            except Exception as e:
+                print(f"Revocation refresh failed: {str(e)}")
+
+
+revocation = TokenRevocation()
@@ -0,0 +1,396 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request
+from functools import wraps
+from pymongo import monitoring
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import atexit
+import ipaddress
+import json
+import os
+import random
+import re
+import threading
+import time
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+MAX_STATEMENT_LENGTH = 1000
+# MongoDB commands awaiting a reply; beyond this the oldest are dropped
+MAX_OPEN_COMMANDS = 1000
+
+TRACEPARENT = re.compile(
+    r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$')
+
+# The recording span of the current request or greenlet; None when the
+# request is not sampled, which makes every instrumentation point a no-op
+_current = ContextVar('trace_span', default=None)
+
+
+def parse_traceparent(header):
+    """
+    (trace_id, parent_span_id, sampled) from a W3C traceparent header, or
+    None when it is missing or malformed
+    """
+    match = TRACEPARENT.match((header or '').strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == 'ff' or (version == '00' and rest):
+        return None
+    if trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+def _new_id(bits):
+    return f'{random.getrandbits(bits) or 1:0{bits // 4}x}'
+
+
+class Span:
+    """
+    One timed operation; ends into the tracer's exporter
+    """
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'kind',
+                 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, tracer, name, kind, trace_id, parent_id=None,
+                 attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def child(self, name, kind=INTERNAL, attributes=None):
+        return Span(self.tracer, name, kind, self.trace_id, self.span_id,
+                    attributes)
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def fail(self, error):
+        self.error = f'{type(error).__name__}: {error}'
+
+    def finish(self):
+        self.end = time.time_ns()
+        self.tracer.exporter.export(self)
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [_attribute(key, value)
+                           for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return span
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class JsonLinesExporter:
+    """
+    Appends finished spans to a file as OTLP/JSON, one
+    ExportTraceServiceRequest per line, so an OpenTelemetry Collector
+    (otlpjsonfile receiver) can ship them anywhere. Spans are buffered and
+    written by a background thread every flush_seconds.
+    """
+    def __init__(self):
+        self.path = None
+        self.service_name = None
+        self.flush_seconds = 1.0
+        self.max_buffer = 512
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def configure(self, path, service_name, flush_seconds):
+        self.path = path
+        self.service_name = service_name
+        self.flush_seconds = flush_seconds
+
+    def export(self, span):
+        self._ensure_started()
+        with self._lock:
+            self._buffer.append(span)
+            full = len(self._buffer) >= self.max_buffer
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if not spans or not self.path:
+            return
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [
+                _attribute('service.name', self.service_name),
+                _attribute('process.pid', os.getpid()),
+            ]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [span.to_otlp() for span in spans],
+            }],
+        }]}, separators=(',', ':'))
+        try:
+            # One append per batch keeps lines from different workers whole
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (line + '\n').encode('utf-8'))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Trace export failed, dropping {len(spans)} spans: {str(e)}")
+
+    def _ensure_started(self):
+        # The flusher thread does not survive a fork, so key it by pid
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._buffer = []
+            threading.Thread(target=self._flush_loop, daemon=True,
+                             name='trace-export').start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+class Tracer:
+    """
+    Request tracing with head sampling: TRACE_SAMPLE_RATE of requests
+    are recorded, plus those whose traceparent says a trusted caller
+    (TRACE_TRUSTED_PEERS) sampled them. Unsampled requests create no
+    spans at all. With a rate of 0 no hooks are installed.
+    """
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.trusted_peers = []
+        self.exporter = JsonLinesExporter()
+        self._sql_hooked = False
+
+    def init_app(self, app):
+        self.sample_rate = app.config['TRACE_SAMPLE_RATE']
+        if self.sample_rate <= 0:
+            return
+        self.trusted_peers = [ipaddress.ip_network(peer, strict=False)
+                              for peer in app.config['TRACE_TRUSTED_PEERS']]
+        self.exporter.configure(app.config['TRACE_EXPORT_PATH'],
+                                app.config['TRACE_SERVICE_NAME'],
+                                app.config['TRACE_FLUSH_SECONDS'])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        self._hook_sql()
+
+    def current(self):
+        return _current.get()
+
+    @contextmanager
+    def span(self, name, kind=INTERNAL, **attributes):
+        """
+        Time the block as a child of the current span; yields None, and
+        costs one lookup, when nothing is being recorded
+        """
+        parent = _current.get()
+        if parent is None:
+            yield None
+            return
+        span = parent.child(name, kind, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.finish()
+
+    def traced(self, name, kind=INTERNAL):
+        """
+        Decorator form of span()
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name, kind):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def inject(self, headers):
+        """
+        Add the current traceparent to outbound request headers
+        """
+        span = _current.get()
+        if span is not None:
+            headers['traceparent'] = span.traceparent()
+        return headers
+
+    def _before_request(self):
+        incoming = parse_traceparent(request.headers.get('traceparent'))
+        if incoming:
+            trace_id, parent_id, sampled = incoming
+            # Anyone can set the flag; only trusted peers may force recording
+            sampled = sampled and self._trusted(request.remote_addr)
+        else:
+            trace_id, parent_id, sampled = None, None, False
+        if not sampled and random.random() >= self.sample_rate:
+            request.environ['trace.token'] = _current.set(None)
+            return
+        span = Span(self, f'{request.method} {request.url_rule or request.path}',
+                    SERVER, trace_id or _new_id(128), parent_id, {
+                        'http.method': request.method,
+                        'http.target': request.path,
+                    })
+        request.environ['trace.span'] = span
+        request.environ['trace.token'] = _current.set(span)
+
+    def _trusted(self, address):
+        if not self.trusted_peers or not address:
+            return False
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_peers)
+
+    def _after_request(self, response):
+        span = request.environ.get('trace.span')
+        if span is not None:
+            span.set('http.status_code', response.status_code)
+            if request.endpoint:
+                span.set('flask.endpoint', request.endpoint)
+        return response
+
+    def _teardown_request(self, exc=None):
+        span = request.environ.pop('trace.span', None)
+        token = request.environ.pop('trace.token', None)
+        if span is not None:
+            if exc is not None:
+                span.fail(exc)
+            span.finish()
+        if token is not None:
+            _current.reset(token)
+
+    def _hook_sql(self):
+        # Every engine, including the replica and shard binds
+        if self._sql_hooked:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        self._sql_hooked = True
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context,
+                           executemany):
+    parent = _current.get()
+    if parent is None:
+        return
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'SQL'
+    span = parent.child(f'sql {verb}', CLIENT, {
+        'db.system': connection.dialect.name,
+        'db.statement': statement[:MAX_STATEMENT_LENGTH],
+        'db.executemany': executemany,
+    })
+    connection.info.setdefault('trace.spans', []).append(span)
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context,
+                          executemany):
+    spans = connection.info.get('trace.spans')
+    if spans:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.set('db.rowcount', cursor.rowcount)
+        span.finish()
+
+
+def _handle_error(context):
+    connection = context.connection
+    spans = connection.info.get('trace.spans') if connection is not None else None
+    if spans:
+        span = spans.pop()
+        span.fail(context.original_exception)
+        span.finish()
+
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """
+    A client span per MongoDB command of a sampled request. Command
+    documents are not recorded, only their name and collection. At most
+    MAX_OPEN_COMMANDS spans wait for a reply; the oldest are dropped.
+    """
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        parent = _current.get()
+        if parent is None:
+            return
+        collection = event.command.get(event.command_name)
+        span = parent.child(f'mongodb {event.command_name}', CLIENT, {
+            'db.system': 'mongodb',
+            'db.name': event.database_name,
+            'db.operation': event.command_name,
+        })
+        if isinstance(collection, str):
+            span.set('db.mongodb.collection', collection)
+        # A command whose connection closes gets neither reply event
+        while len(self._spans) >= MAX_OPEN_COMMANDS:
+            try:
+                self._spans.pop(next(iter(self._spans)))
+            except (KeyError, RuntimeError, StopIteration):
+                break
+        self._spans[(event.connection_id, event.request_id)] = span
+
+    def succeeded(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.finish()
+
+    def failed(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.error = f'{event.failure.get("codeName", "CommandError")}: ' \
+                         f'{event.failure.get("errmsg", "")}'
+            span.finish()
+
+
+tracer = Tracer()
+mongo_command_tracer = MongoCommandTracer()
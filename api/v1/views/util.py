@@ -1,2 +1,99 @@
+from flask import request, make_response
+from werkzeug.exceptions import BadRequest
+import base64
+import hashlib
+import json
+
+
 def to_dict(obj):
-    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
\ No newline at end of file
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def parse_fields(allowed, default=None, param='fields'):
+    """
+    Parse a ?fields= style query parameter against an allow-list.
+    Returns the requested field names in order, or the default
+    (every allowed field) when the parameter is absent.
+    """
+    raw = request.args.get(param)
+    if not raw:
+        return list(default or allowed)
+
+    fields = []
+    for field in raw.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise BadRequest(f"Unknown field(s): {', '.join(unknown)}")
+    if not fields:
+        raise BadRequest('No fields requested')
+    return fields
+
+
+def make_etag(*parts):
+    """
+    Build a strong ETag from the values that identify a representation
+    """
+    raw = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """
+    Return a bodiless 304 response when the client's If-None-Match
+    already holds etag, otherwise None
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def with_etag(response, etag):
+    """
+    Attach etag to a response so clients can revalidate it
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def encode_cursor(*values):
+    """
+    Pack the sort key of the last row on a page into an opaque cursor
+    """
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    """
+    Unpack a cursor made by encode_cursor, rejecting anything malformed
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise BadRequest('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise BadRequest('Invalid cursor')
+    return values
+
+
+# Driver error codes for a duplicate key: MySQL ER_DUP_ENTRY, PostgreSQL
+# unique_violation; SQLite only says so in the message
+_DUPLICATE_KEY_CODES = (1062, '23505')
+
+
+def is_unique_violation(error):
+    """
+    True when an IntegrityError was raised by a unique or primary key
+    constraint, rather than e.g. a NOT NULL or foreign key one
+    """
+    orig = getattr(error, 'orig', error)
+    code = getattr(orig, 'pgcode', None) or (orig.args[0] if orig.args else None)
+    return code in _DUPLICATE_KEY_CODES or 'UNIQUE constraint failed' in str(orig)
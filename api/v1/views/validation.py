@@ -0,0 +1,101 @@
+from flask import jsonify, request
+from functools import wraps
+import re
+import yaml
+
+# Formats used in the docstrings beyond the JSON Schema built-ins
+FORMATS = {
+    'card_number': r'^[A-Za-z0-9][A-Za-z0-9 -]{0,119}$',
+    'account_type': r'^[A-Za-z0-9_ -]{1,120}$',
+    'email': r'^[^@\s]+@[^@\s]+\.[^@\s]+$',
+}
+
+
+def body_schema(view):
+    """
+    The JSON schema of the view's `in: body` parameter, read from its
+    flasgger docstring
+    """
+    doc = view.__doc__ or ''
+    if '---' not in doc:
+        raise ValueError(f'{view.__name__} has no swagger docstring')
+    spec = yaml.safe_load(doc.split('---', 1)[1]) or {}
+    for parameter in spec.get('parameters', []):
+        if parameter.get('in') == 'body':
+            return _strip_ids(dict(parameter['schema'], type='object'))
+    raise ValueError(f'{view.__name__} documents no body parameter')
+
+
+def _strip_ids(schema):
+    # flasgger uses `id` to name definitions; JSON Schema reads it as a base URI
+    if isinstance(schema, dict):
+        return {key: _strip_ids(value) for key, value in schema.items()
+                if key != 'id' or not isinstance(value, str)}
+    if isinstance(schema, list):
+        return [_strip_ids(value) for value in schema]
+    return schema
+
+
+def compile_schema(schema):
+    """
+    A function that returns None for a valid body and (field, message) for
+    an invalid one. Uses fastjsonschema's generated code when installed,
+    otherwise a jsonschema validator.
+    """
+    try:
+        import fastjsonschema
+    except ImportError:
+        fastjsonschema = None
+
+    if fastjsonschema is not None:
+        validate = fastjsonschema.compile(schema, formats=FORMATS)
+
+        def check(body):
+            try:
+                validate(body)
+            except fastjsonschema.JsonSchemaValueException as e:
+                field = e.name[len('data.'):] if e.name.startswith('data.') else None
+                return field, e.message.replace(e.name, field or 'body', 1)
+            return None
+        return check
+
+    from jsonschema import Draft4Validator, FormatChecker
+    from jsonschema.exceptions import best_match
+
+    checker = FormatChecker()
+    for name, pattern in FORMATS.items():
+        checker.checks(name)(
+            lambda value, regex=re.compile(pattern): not isinstance(value, str)
+            or regex.match(value) is not None)
+    validator = Draft4Validator(schema, format_checker=checker)
+
+    def check(body):
+        error = best_match(validator.iter_errors(body))
+        if error is None:
+            return None
+        field = '.'.join(str(part) for part in error.absolute_path) or None
+        return field, f'{field or "body"}: {error.message}'
+    return check
+
+
+def validate_body(view):
+    """
+    Reject requests whose JSON body does not match the schema documented in
+    the view's docstring, before the view or any other decorator does I/O.
+    The schema is compiled once, when the view is defined.
+    """
+    check = compile_schema(body_schema(view))
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({'error': 'Request body must be a JSON object',
+                            'code': 'val400'}), 400
+        failure = check(body)
+        if failure is not None:
+            field, message = failure
+            return jsonify({'error': f'Invalid request body: {message}',
+                            'field': field, 'code': 'val400'}), 400
+        return view(*args, **kwargs)
+    return wrapper
@@ -11,9 +11,12 @@ from flask_mail import Mail, Message
 from flask import current_app, url_for
 from random import randint
 import time
+from .profiling import memory_stats
+from .tracing import tracer, CLIENT
 
 
 all_code = {}
+memory_stats.watch('verification_codes', all_code.__len__)
 def generate_verification_code(email):
     """
     Generate a random verification code and store it with an expiration time
@@ -81,5 +84,6 @@ def send_ver_code(email):
             f"Thank You"
         )
       mail = Mail(current_app)
-      mail.send(msg)
+      with tracer.span('smtp send', CLIENT, **{'mail.recipients': len(msg.recipients)}):
+        mail.send(msg)
 
@@ -0,0 +1,96 @@
+from pymongo import UpdateOne
+import atexit
+import os
+import threading
+
+from ..models import user_collection
+
+
+class WriteBehindBuffer:
+    """
+    Collects non-critical $set updates in memory and writes them as one
+    unordered bulk_write every WRITE_BEHIND_FLUSH_MS, or sooner once
+    WRITE_BEHIND_MAX_ENTRIES documents are pending. Repeat updates to the
+    same document are coalesced, the newest value winning. While MongoDB
+    is failing, updates wait for the next flush, up to
+    WRITE_BEHIND_MAX_PENDING documents; beyond that the oldest are dropped.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.flush_seconds = 0.5
+        self.max_entries = 500
+        self.max_pending = 50000
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def init_app(self, app):
+        self.flush_seconds = app.config['WRITE_BEHIND_FLUSH_MS'] / 1000
+        self.max_entries = app.config['WRITE_BEHIND_MAX_ENTRIES']
+        self.max_pending = app.config['WRITE_BEHIND_MAX_PENDING']
+
+    def set(self, document_id, fields):
+        """
+        Queue {'$set': fields} for the document with _id document_id
+        """
+        self._ensure_started()
+        with self._lock:
+            self._pending.setdefault(document_id, {}).update(fields)
+            full = len(self._pending) >= self.max_entries
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write everything pending now; called by the flusher thread and on
+        worker shutdown
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            self.collection.bulk_write(
+                [UpdateOne({'_id': document_id}, {'$set': fields})
+                 for document_id, fields in batch.items()],
+                ordered=False
+            )
+        except Exception as e:
+            print(f"Write-behind flush failed, retrying later: {str(e)}")
+            with self._lock:
+                # Keep anything queued since, it is newer than the failed batch
+                pending = {}
+                for document_id, fields in batch.items():
+                    pending[document_id] = {**fields,
+                                            **self._pending.pop(document_id, {})}
+                pending.update(self._pending)
+                # Oldest first; a long outage must not grow the worker unbounded
+                dropped = len(pending) - self.max_pending
+                for document_id in list(pending)[:max(dropped, 0)]:
+                    del pending[document_id]
+                self._pending = pending
+            if dropped > 0:
+                print(f"Write-behind buffer full, dropped {dropped} oldest updates")
+
+    def _ensure_started(self):
+        # The flusher thread does not survive a fork, so key it by pid
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, daemon=True,
+                             name='write-behind-flush').start()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+
+# last_login / last_logout stamps on user documents
+login_stamps = WriteBehindBuffer(user_collection)
@@ -0,0 +1,176 @@
+"""
+Compare worker models: memory per worker and request throughput
+
+    python benchmarks/serve_models.py [--models sync gthread gevent]
+        [--path /api/v1/health/live] [--requests 5000] [--concurrency 32]
+
+Run from the backend directory with the same environment the service uses.
+Each model is started with `python -m api.v1.serve` on a free local port,
+driven with concurrent requests, then measured from /proc (Linux only).
+PSS splits shared pages between the processes sharing them, so the gap
+between RSS and PSS per worker is what preloading with gc.freeze() keeps
+shared.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def child_pids(parent):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # The command name may contain spaces; fields follow the ')'
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            pids.append(int(entry))
+    return pids
+
+
+def memory_kib(pid):
+    """
+    {'rss': ..., 'pss': ...} of one process in KiB
+    """
+    usage = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps:
+            for line in smaps:
+                key, _, value = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    usage[key.lower()] = int(value.split()[0])
+    except OSError:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    usage['rss'] = usage['pss'] = int(line.split()[1])
+    return usage
+
+
+def wait_until_up(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=1)
+            connection.request('GET', '/api/v1/health/live')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not come up')
+
+
+def drive(port, path, requests, concurrency):
+    """
+    Send requests from concurrency clients; (seconds, latencies, errors)
+    """
+    per_client = requests // concurrency
+
+    def client(_):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies, errors = [], 0
+        for _ in range(per_client):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    seconds = time.perf_counter() - started
+    latencies = sorted(latency for result, _ in results for latency in result)
+    return seconds, latencies, sum(errors for _, errors in results)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(model, options):
+    port = free_port()
+    command = [sys.executable, '-m', 'api.v1.serve', '--worker-class', model,
+               '--bind', f'127.0.0.1:{port}', '--max-requests', '0']
+    if options.workers:
+        command += ['--workers', str(options.workers)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port, process)
+        drive(port, options.path, options.concurrency * 10,
+              options.concurrency)
+        seconds, latencies, errors = drive(port, options.path,
+                                           options.requests,
+                                           options.concurrency)
+        workers = [memory_kib(pid) for pid in child_pids(process.pid)]
+        master = memory_kib(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+    return {
+        'model': model,
+        'workers': len(workers),
+        'rps': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': errors,
+        'rss_mib': sum(w['rss'] for w in workers) / len(workers) / 1024,
+        'pss_mib': sum(w['pss'] for w in workers) / len(workers) / 1024,
+        'master_rss_mib': master['rss'] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', nargs='+',
+                        default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--path', default='/api/v1/health/live')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int,
+                        help='Same worker count for every model instead of '
+                             'each model\'s auto-sizing')
+    options = parser.parse_args()
+
+    columns = ['model', 'workers', 'rps', 'p50_ms', 'p99_ms', 'errors',
+               'rss_mib', 'pss_mib', 'master_rss_mib']
+    print(' '.join(f'{column:>14}' for column in columns))
+    for model in options.models:
+        result = bench(model, options)
+        print(' '.join(
+            f'{result[column]:>14.1f}' if isinstance(result[column], float)
+            else f'{result[column]:>14}' for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+The app runs on SQLite with two SQLite shards, and mongomock stands in
+for MongoDB. Both are chosen through the environment, so this must run
+before the api package is imported.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+import mongomock
+import pymongo
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix='swaz_tests_')
+os.environ['DATABASE_URL'] = f'sqlite:///{_data_dir}/main.db'
+os.environ['DATABASE_SHARD_URLS'] = ','.join(
+    f'sqlite:///{_data_dir}/shard_{index}.db' for index in range(2))
+os.environ['FLASK_ENV'] = 'testing'
+pymongo.MongoClient = mongomock.MongoClient
+# users.account_type is a list, which MySQL takes as a SET
+sqlite3.register_adapter(list, ','.join)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect  # noqa: E402
+
+from api.v1 import create_app  # noqa: E402
+from api.v1.models import db, default_collection  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app('testing')
+    app.config['ADMIN_API_KEY'] = 'test-admin-key'
+    app.config['JWT_SECRET_KEY'] = 'test-jwt-secret-long-enough-for-hs256'
+    return app
+
+
+@pytest.fixture(autouse=True)
+def app_context(app):
+    """
+    Every test starts with empty databases, inside an application context
+    """
+    with app.app_context():
+        yield
+        db.session.remove()
+        for engine in db.engines.values():
+            existing = set(inspect(engine).get_table_names())
+            with engine.begin() as connection:
+                for table in reversed(db.metadata.sorted_tables):
+                    if table.name in existing:
+                        connection.execute(table.delete())
+        for name in default_collection.list_collection_names():
+            default_collection.drop_collection(name)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user():
+    """
+    Create a user with one wallet on the shard the card number maps to
+    """
+    from api.v1.database.sharding import shard_for, use_shard
+    from api.v1.models.user import User, Wallet
+
+    def make(card_number, full_name='Test User', daily_amount=None,
+             start_on=None, balance=0.0):
+        user = User(full_name=full_name, card_number=card_number,
+                    account_type='standard', phone_number='+234 800 000 0000')
+        wallet = Wallet(user_id=user.id, card_number=card_number)
+        wallet.balance = balance
+        if daily_amount is not None:
+            wallet.schedule_contribution(daily_amount, start_on)
+        with use_shard(shard_for(card_number)):
+            user.wallets.append(wallet)
+            db.session.add_all([user, wallet])
+            ids = user.id, wallet.id
+            db.session.commit()
+        return ids
+    return make
@@ -0,0 +1,34 @@
+from flask_jwt_extended import create_access_token
+
+from api.v1.models import revoked_token_collection
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_logged_out_token_is_rejected(client, make_user):
+    user_id, _ = make_user('8000000000000001')
+    token = create_access_token(identity=user_id)
+    other_session = create_access_token(identity=user_id)
+
+    response = client.post('/api/v1/auth/logout', headers=bearer(token))
+    assert response.status_code == 200
+    assert revoked_token_collection.count_documents({}) == 1
+
+    response = client.post('/api/v1/auth/logout', headers=bearer(token))
+    assert response.status_code == 401
+    assert response.get_json()['msg'] == 'Token has been revoked'
+    # Only the token that logged out is revoked
+    response = client.post('/api/v1/auth/logout',
+                           headers=bearer(other_session))
+    assert response.status_code == 200
+
+
+def test_logout_revokes_the_token_of_an_unknown_user(client):
+    token = create_access_token(identity='no-such-user')
+
+    assert client.post('/api/v1/auth/logout',
+                       headers=bearer(token)).status_code == 200
+    assert client.post('/api/v1/auth/logout',
+                       headers=bearer(token)).status_code == 401
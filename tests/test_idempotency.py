@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import threading
+
+from api.v1.models import idempotency_collection
+from api.v1.views.idempotency import _claim
+
+
+def test_only_one_concurrent_claim_wins(app):
+    start = threading.Barrier(8)
+
+    def claim(owner):
+        with app.app_context():
+            start.wait()
+            return _claim('id:1:POST:/api/v1/user/user:key', 'fingerprint',
+                          owner)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(claim,
+                                [f'owner-{index}' for index in range(8)]))
+
+    winners = [index for index, record in enumerate(results) if record is None]
+    assert len(winners) == 1
+    stored = idempotency_collection.find_one()
+    assert stored['owner'] == f'owner-{winners[0]}'
+    # Everyone else is shown the winner's pending record
+    assert all(record['owner'] == stored['owner']
+               for record in results if record is not None)
+
+
+def test_expired_lease_is_taken_over_only_for_the_same_payload():
+    assert _claim('key', 'fingerprint', 'first') is None
+    idempotency_collection.update_one(
+        {'_id': 'key'},
+        {'$set': {'locked_until': datetime.utcnow() - timedelta(seconds=1)}})
+
+    assert _claim('key', 'other payload', 'second')['owner'] == 'first'
+    assert _claim('key', 'fingerprint', 'third') is None
+    assert idempotency_collection.find_one({'_id': 'key'})['owner'] == 'third'
+
+
+def test_retry_replays_the_stored_response_for_the_same_caller(client):
+    headers = {'Idempotency-Key': 'register-1'}
+    body = {'fullName': 'Ada Obi', 'card_number': '7000000000000001',
+            'phone_number': '+234 801 000 0001', 'account_type': 'standard'}
+
+    first = client.post('/api/v1/user/user', json=body, headers=headers)
+    again = client.post('/api/v1/user/user', json=body, headers=headers)
+    assert first.status_code == 201
+    assert again.status_code == 201
+    assert again.get_data() == first.get_data()
+    assert again.headers['Idempotent-Replayed'] == 'true'
+
+    changed = client.post('/api/v1/user/user',
+                          json=dict(body, fullName='Other'), headers=headers)
+    assert changed.status_code == 422
+
+    # Another caller's identical key is a different request: it runs, and
+    # finds the card number taken
+    other = client.post('/api/v1/user/user', json=body, headers=headers,
+                        environ_base={'REMOTE_ADDR': '10.1.2.3'})
+    assert other.status_code == 409
+    assert 'Idempotent-Replayed' not in other.headers
@@ -0,0 +1,71 @@
+from datetime import date
+
+from api.v1.database.sharding import shard_for, use_shard
+from api.v1.jobs.posting import post_chunk, run_daily_posting
+from api.v1.models import db
+from api.v1.models.contribution import (ContributionDailyTotal,
+                                        ContributionPosting)
+from api.v1.models.user import Wallet
+
+RUN_DATE = date(2026, 3, 10)
+
+
+def wallet_on_shard(card_number, wallet_id):
+    """
+    (balance, next_due_on, [(posting_date, amount)]) of one wallet
+    """
+    with use_shard(shard_for(card_number)):
+        wallet = db.session.get(Wallet, wallet_id)
+        balance, next_due_on = wallet.balance, wallet.next_due_on
+        postings = sorted(
+            (posting.posting_date, posting.amount)
+            for posting in ContributionPosting.query.filter_by(
+                wallet_id=wallet_id))
+        db.session.rollback()
+    return balance, next_due_on, postings
+
+
+def test_post_chunk_twice_posts_nothing_the_second_time(make_user):
+    _, wallet_id = make_user('6000000000000001', daily_amount=25,
+                             start_on=RUN_DATE)
+    engine = db.engines[shard_for('6000000000000001')]
+
+    with engine.begin() as connection:
+        assert post_chunk(connection, [wallet_id], RUN_DATE) == 1
+    with engine.begin() as connection:
+        assert post_chunk(connection, [wallet_id], RUN_DATE) == 0
+
+    assert wallet_on_shard('6000000000000001', wallet_id) == (
+        25, date(2026, 3, 11), [(RUN_DATE, 25)])
+
+
+def test_catch_up_stops_before_overdrawing(make_user):
+    _, saver = make_user('6000000000000002', daily_amount=10,
+                         start_on=date(2026, 3, 7))
+    _, spender = make_user('6000000000000003', daily_amount=-30,
+                           start_on=date(2026, 3, 8), balance=70)
+    _, short = make_user('6000000000000004', daily_amount=-50,
+                         start_on=RUN_DATE, balance=40)
+
+    report = run_daily_posting(RUN_DATE)
+    assert (report.posted, report.skipped) == (2, 1)
+    assert run_daily_posting(RUN_DATE).posted == 0
+
+    balance, next_due_on, postings = wallet_on_shard('6000000000000002', saver)
+    assert (balance, next_due_on) == (40, date(2026, 3, 11))
+    assert [day for day, _ in postings] == [date(2026, 3, day)
+                                            for day in (7, 8, 9, 10)]
+    # The third debit would overdraw; that day stays due
+    assert wallet_on_shard('6000000000000003', spender) == (
+        10, RUN_DATE, [(date(2026, 3, 8), -30), (date(2026, 3, 9), -30)])
+    assert wallet_on_shard('6000000000000004', short) == (40, RUN_DATE, [])
+
+    totals = {}
+    for shard in {shard_for(f'600000000000000{index}') for index in (2, 3, 4)}:
+        with use_shard(shard):
+            for row in ContributionDailyTotal.query.filter_by(day=RUN_DATE):
+                amount, count = totals.get(row.account_type, (0, 0))
+                totals[row.account_type] = (amount + row.total_amount,
+                                            count + row.postings)
+            db.session.rollback()
+    assert totals == {'standard': (10, 1)}
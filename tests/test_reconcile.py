@@ -0,0 +1,56 @@
+from api.v1.jobs.reconcile import (CHECKSUM_FIELD, mirror_checksum,
+                                   reconcile_users)
+from api.v1.models import user_collection
+
+
+def register(client, card_number, full_name):
+    response = client.post('/api/v1/user/user', json={
+        'fullName': full_name, 'card_number': card_number,
+        'phone_number': '+234 802 000 0000', 'account_type': 'standard'})
+    assert response.status_code == 201
+    return response.get_json()['user']['id']
+
+
+def test_mirror_written_by_the_api_reconciles_clean(client):
+    for index in range(7):
+        register(client, f'9000000000000{index:03d}', f'User {index}')
+
+    report = reconcile_users(batch_size=3)
+    assert report.rows_checked == 7
+    assert report.batches == report.identical_batches
+    assert (report.missing, report.orphaned, report.mismatched) == (0, 0, 0)
+
+
+def test_repair_makes_mongo_match_sql(client):
+    ids = [register(client, f'9100000000000{index:03d}', f'User {index}')
+           for index in range(7)]
+    user_collection.delete_one({'id': ids[0]})
+    user_collection.update_one({'id': ids[3]}, {'$set': {'fullName': 'Wrong'}})
+    user_collection.insert_one({'id': 'ffffffff-orphan', 'fullName': 'Gone'})
+    # Written before checksums existed: same values, nothing stamped
+    user_collection.update_one({'id': ids[5]}, {'$unset': {CHECKSUM_FIELD: 1}})
+
+    issues = []
+    report = reconcile_users(batch_size=3, repair=True,
+                             on_issue=lambda kind, user_id: issues.append(
+                                 (kind, user_id)))
+    assert sorted(issues) == sorted([('missing', ids[0]),
+                                     ('mismatched', ids[3]),
+                                     ('orphaned', 'ffffffff-orphan')])
+    assert report.repaired == 4
+
+    report = reconcile_users(batch_size=3)
+    assert report.batches == report.identical_batches
+    assert (report.missing, report.orphaned, report.mismatched) == (0, 0, 0)
+    document = user_collection.find_one({'id': ids[3]})
+    assert document['fullName'] == 'User 3'
+    assert document[CHECKSUM_FIELD] == mirror_checksum(document)
+
+
+def test_full_pass_catches_edits_that_kept_the_checksum(client):
+    user_id = register(client, '9200000000000001', 'User')
+    user_collection.update_one({'id': user_id},
+                               {'$set': {'fullName': 'Edited'}})
+
+    assert reconcile_users().mismatched == 0
+    assert reconcile_users(full=True).mismatched == 1
@@ -0,0 +1,68 @@
+from datetime import date
+
+from api.v1.database.sharding import (jump_hash, move_users, rebalance,
+                                      shard_for, shard_keys, shard_of_user,
+                                      use_shard)
+from api.v1.models import db
+from api.v1.models.contribution import ContributionPosting
+from api.v1.models.user import User, Wallet
+from api.v1.jobs.posting import run_daily_posting
+
+
+def other_shard(shard):
+    return next(key for key in shard_keys() if key != shard)
+
+
+def test_jump_hash_moves_only_keys_for_the_new_bucket():
+    keys = range(2000)
+    before = [jump_hash(key, 4) for key in keys]
+    after = [jump_hash(key, 5) for key in keys]
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+    assert all(new == 4 for _, new in moved)
+    assert 250 < len(moved) < 550
+
+
+def test_move_users_round_trip(make_user):
+    user_id, wallet_id = make_user('4000111122223333', daily_amount=10,
+                                   start_on=date(2026, 1, 1))
+    run_daily_posting(date(2026, 1, 2))
+    home = shard_for('4000111122223333')
+    away = other_shard(home)
+
+    assert move_users(home, away, [user_id]) == 1
+    with use_shard(home):
+        assert db.session.get(User, user_id) is None
+        assert db.session.get(Wallet, wallet_id) is None
+    with use_shard(away):
+        user = db.session.get(User, user_id)
+        assert [wallet.id for wallet in user.wallets] == [wallet_id]
+        assert ContributionPosting.query.filter_by(
+            wallet_id=wallet_id).count() == 2
+    db.session.rollback()
+    assert shard_of_user(user_id) == away
+
+    assert move_users(away, home, [user_id]) == 1
+    with use_shard(home):
+        assert db.session.get(Wallet, wallet_id).balance == 20
+        assert ContributionPosting.query.filter_by(
+            wallet_id=wallet_id).count() == 2
+    with use_shard(away):
+        assert db.session.get(User, user_id) is None
+    db.session.rollback()
+    assert shard_of_user('4000111122223333') == home
+
+
+def test_rebalance_puts_misplaced_users_back(make_user):
+    cards = [f'5000{index:012d}' for index in range(12)]
+    ids = {card: make_user(card)[0] for card in cards}
+    for card in cards[:5]:
+        home = shard_for(card)
+        move_users(home, other_shard(home), [ids[card]])
+
+    planned = rebalance()
+    assert sum(planned.values()) == 5
+    assert rebalance(execute=True) == planned
+    assert rebalance() == {}
+    for card in cards:
+        with use_shard(shard_for(card)):
+            assert User.query.filter_by(card_number=card).one().id == ids[card]